@@ -0,0 +1,111 @@
+"""
+Module to fetch pages from WooCommerce on a single asyncio event loop
+instead of one OS thread per in-flight request
+"""
+import asyncio
+import json
+import time
+from config import APP
+from connections import wcapi
+from pipeline import Pipeline, PageError, _DONE
+import metrics
+import profiles
+import throttle
+
+
+class AsyncPipeline(Pipeline):
+    """
+    Pipeline whose fetch stage is one thread running an event loop with up
+    to `concurrency` requests in flight
+
+    Takes the same arguments as Pipeline.
+    """
+
+    def __init__(
+        self, endpoint, transform, write, concurrency=APP.ASYNC_CONCURRENCY, **kwargs
+    ):
+        kwargs["fetch_workers"] = 1
+        super().__init__(endpoint, transform, write, **kwargs)
+        self.concurrency = concurrency
+
+    def _fetch_worker(self):
+        asyncio.run(self._fetch_all())
+
+    async def _fetch_all(self):
+        try:
+            import aiohttp
+        except ImportError:
+            print("The async engine requires aiohttp (pip install aiohttp)")
+            # fail the pages so the pipeline can still shut down, and keep
+            # them in the dead-letter file to be fetched again
+            while True:
+                item = self.tasks.get()
+                if item is _DONE:
+                    return
+                self._give_up(*item, "aiohttp is not installed")
+
+        loop = asyncio.get_running_loop()
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency, ssl=None if wcapi.verify_ssl else False
+        )
+        timeout = aiohttp.ClientTimeout(total=wcapi.timeout)
+        headers = {"user-agent": wcapi.user_agent, "accept": "application/json"}
+
+        async with aiohttp.ClientSession(
+            connector=connector, timeout=timeout, headers=headers
+        ) as session:
+            while True:
+                # the task queue is a thread queue so wait on it off the loop
+                item = await loop.run_in_executor(None, self.tasks.get)
+                if item is _DONE:
+                    break
+                await slots.acquire()
+                request = asyncio.create_task(self._fetch_one(session, *item))
+                in_flight.add(request)
+                request.add_done_callback(in_flight.discard)
+                request.add_done_callback(lambda _: slots.release())
+
+            if in_flight:
+                await asyncio.gather(*in_flight)
+
+    async def _fetch_one(self, session, task, attempt):
+        import aiohttp
+
+        params = profiles.with_fields(self.endpoint, task)
+        url, params, auth = wcapi.request_args(self.endpoint, params)
+        if auth:
+            auth = aiohttp.BasicAuth(*auth)
+
+        status_code = retry_after = None
+        await throttle.limiter.acquire_async()
+        started = time.monotonic()
+        try:
+            async with session.get(url, params=params, auth=auth) as response:
+                status_code = response.status
+                retry_after = response.headers.get("Retry-After")
+                if response.status != 200:
+                    raise PageError(f"Error status code {response.status}")
+                body = await response.read()
+        except Exception as e:
+            self._fetch_failed(task, attempt, e)
+            return
+        finally:
+            elapsed = time.monotonic() - started
+            throttle.limiter.release(elapsed, status_code, retry_after)
+            metrics.observe("http_request_seconds", elapsed, resource=self.endpoint)
+
+        # the body is decompressed by now, Content-Length is the size sent
+        received = response.content_length or len(body)
+        metrics.inc("http_received_bytes", received, resource=self.endpoint)
+        try:
+            with metrics.timer("json_decode_seconds", resource=self.endpoint):
+                records = json.loads(body)
+        except ValueError as e:
+            self._fetch_failed(task, attempt, e)
+            return
+
+        # a full transform queue holds this request back, not the loop
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._fetched, task, records)
@@ -0,0 +1,145 @@
+"""
+Microbenchmark of the date conversion of records: the previous per-field
+dateutil loop against the converters in dates.py
+
+python benchmarks/bench_dates.py [--records 10000] [--repeat 5]
+"""
+import copy
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+import click
+from dateutil import parser as dateparser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dates import ORDER_DATES, PRODUCT_DATES, parse_date  # noqa: E402
+
+
+def make_dates(moment, prefix):
+    return {
+        f"{prefix}": moment.strftime("%Y-%m-%dT%H:%M:%S"),
+        f"{prefix}_gmt": (moment - timedelta(hours=2)).strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def make_records(count, seed=1):
+    """Orders and products shaped like the WooCommerce responses."""
+    rand = random.Random(seed)
+    start = datetime(2021, 1, 1)
+    orders, products = [], []
+    for i in range(count):
+        created = start + timedelta(seconds=rand.randrange(0, 365 * 86400))
+        modified = created + timedelta(seconds=rand.randrange(0, 30 * 86400))
+        order = {"id": i}
+        order.update(make_dates(created, "date_created"))
+        order.update(make_dates(modified, "date_modified"))
+        order.update(make_dates(created, "date_paid"))
+        order.update({"date_completed": None, "date_completed_gmt": None})
+        orders.append(order)
+
+        product = {"id": i, "images": []}
+        product.update(make_dates(created, "date_created"))
+        product.update(make_dates(modified, "date_modified"))
+        product.update({"date_on_sale_from": None, "date_on_sale_to": None})
+        for _ in range(3):
+            image = {}
+            image.update(make_dates(created, "date_created"))
+            image.update(make_dates(modified, "date_modified"))
+            product["images"].append(image)
+        products.append(product)
+    return orders, products
+
+
+def old_order(order):
+    date_fields = [
+        "date_created",
+        "date_created_gmt",
+        "date_modified",
+        "date_modified_gmt",
+        "date_paid",
+        "date_paid_gmt",
+        "date_completed",
+        "date_completed_gmt",
+    ]
+    for field in date_fields:
+        if field not in order:
+            continue
+        str_date = order[field]
+        if not str_date:
+            continue
+        order[field] = dateparser.isoparse(str_date)
+    return order
+
+
+def old_product(product):
+    date_fields = [
+        "date_created",
+        "date_created_gmt",
+        "date_modified",
+        "date_modified_gmt",
+        "date_on_sale_from",
+        "date_on_sale_from_gmt",
+        "date_on_sale_to",
+        "date_on_sale_to_gmt",
+    ]
+    image_date_fields = date_fields[:4]
+    for field in date_fields:
+        if field not in product:
+            continue
+        str_date = product[field]
+        if not str_date:
+            continue
+        product[field] = dateparser.isoparse(str_date)
+
+    for field in image_date_fields:
+        for i in range(len(product["images"])):
+            if field not in product["images"][i]:
+                continue
+            str_date = product["images"][i][field]
+            if not str_date:
+                continue
+            product["images"][i][field] = dateparser.isoparse(str_date)
+    return product
+
+
+def measure(convert, records, repeat):
+    """Best seconds per record over `repeat` runs on fresh copies."""
+    best = None
+    for _ in range(repeat):
+        batch = copy.deepcopy(records)
+        parse_date.cache_clear()
+        seconds = timeit.timeit(lambda: [convert(r) for r in batch], number=1)
+        best = seconds if best is None else min(best, seconds)
+    return best / len(records)
+
+
+@click.command()
+@click.option("--records", default=10000, help="Records of each resource")
+@click.option("--repeat", default=5, help="Runs, the fastest is reported")
+def main(records, repeat):
+    orders, products = make_records(records)
+
+    # both ways must give the same documents
+    assert old_order(copy.deepcopy(orders[0])) == ORDER_DATES(copy.deepcopy(orders[0]))
+    assert old_product(copy.deepcopy(products[0])) == PRODUCT_DATES(
+        copy.deepcopy(products[0])
+    )
+
+    print(f"{'resource':<10}{'dateutil':>14}{'dates.py':>14}{'speedup':>10}")
+    for name, records_, old, new in [
+        ("orders", orders, old_order, ORDER_DATES),
+        ("products", products, old_product, PRODUCT_DATES),
+    ]:
+        before = measure(old, records_, repeat)
+        after = measure(new, records_, repeat)
+        print(
+            f"{name:<10}{before * 1e6:>11.1f} us{after * 1e6:>11.1f} us"
+            f"{before / after:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""
+End-to-end benchmark of the importers against the local mock store
+(benchmarks/mock_wc.py), writing to mongomock or a local mongod
+
+Every engine and resource runs in its own process, so the peak RSS is
+that run's own, while the mock store is served from this process.
+Customers are always scanned on threads, so they only get a threads row.
+
+pip install -r benchmarks/requirements.txt  # adds mongomock
+python benchmarks/bench_import.py --orders 20000 --engine threads --engine async
+python benchmarks/bench_import.py --latency 0.1 --error-rate 0.02 --rate-429 0.01
+python benchmarks/bench_import.py --mongo mongodb://localhost:27017
+"""
+import contextlib
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import sys
+import time
+import click
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_wc import MockStore, serve  # noqa: E402
+
+FROM_DATE = "2022-01-01T00:00:00"
+TO_DATE = "2023-01-01T00:00:00"
+
+
+def percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+def run_import(config, results):
+    """Run one import in this (child) process and put its numbers in results."""
+    os.environ.update(
+        SITE=config["site"],
+        consumer_key="ck_benchmark",
+        consumer_secret="cs_benchmark",
+        MONGO_URI=config["mongo"] or "mongodb://localhost:27017",
+        MONGO_DB=config["database"],
+    )
+    import connections
+
+    if not config["mongo"]:
+        import mongomock
+
+        connections.provider.use(client=mongomock.MongoClient())
+    connections.db.client.drop_database(config["database"])
+
+    import customers, orders, products, profiles, throttle
+
+    profiles.select(config["payload"])
+
+    # both engines report every request to the limiter, so time pages there
+    latencies = []
+    limiter = throttle.limiter
+    release = limiter.release
+
+    def record_release(latency, *args, **kwargs):
+        latencies.append(latency)
+        return release(latency, *args, **kwargs)
+
+    limiter.release = record_release
+
+    engine = config["engine"]
+    runs = {
+        "orders": lambda: orders.import_all_orders(
+            "desc", FROM_DATE, TO_DATE, engine=engine, shard_size=config["shard_size"]
+        ),
+        "products": lambda: products.import_all_products(
+            "desc", FROM_DATE, TO_DATE, engine=engine, shard_size=config["shard_size"]
+        ),
+        "customers": lambda: customers.import_all_customers("desc", FROM_DATE, TO_DATE),
+    }
+    collections = {
+        "orders": "ORDER_COLLECTION",
+        "products": "PRODUCT_COLLECTION",
+        "customers": "CUSTOMER_COLLECTION",
+    }
+
+    output = open(os.devnull, "w") if config["quiet"] else sys.stdout
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+        runs[config["resource"]]()
+    elapsed = time.perf_counter() - started
+
+    from config import DB
+
+    collection = getattr(DB, collections[config["resource"]])
+    written = connections.db[collection].count_documents({})
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss /= 1024 * (1024 if sys.platform == "darwin" else 1)
+
+    results.put(
+        {
+            "resource": config["resource"],
+            "engine": engine,
+            "records": written,
+            "seconds": elapsed,
+            "records_per_second": written / elapsed if elapsed else 0,
+            "requests": len(latencies),
+            "p50_ms": percentile(latencies, 0.5) * 1000,
+            "p99_ms": percentile(latencies, 0.99) * 1000,
+            "peak_rss_mb": peak_rss,
+        }
+    )
+
+
+@click.command()
+@click.option("--orders", default=5000, help="Orders in the mock store")
+@click.option("--products", default=1000, help="Products in the mock store")
+@click.option("--customers", default=1000, help="Customers in the mock store")
+@click.option(
+    "--resource",
+    "resources",
+    multiple=True,
+    type=click.Choice(["orders", "products", "customers"]),
+    help="Resources to import (all by default), can be repeated",
+)
+@click.option(
+    "--engine",
+    "engines",
+    multiple=True,
+    type=click.Choice(["threads", "async"]),
+    help="Fetch engines to compare (threads by default), can be repeated",
+)
+@click.option("--latency", default=0.02, help="Mean seconds the store takes per page")
+@click.option("--jitter", default=0.01, help="Random +/- seconds around the latency")
+@click.option("--error-rate", default=0.0, help="Share of 503 responses")
+@click.option("--rate-429", default=0.0, help="Share of 429 responses")
+@click.option("--shard-size", default=0, help="--shard-size of the imports")
+@click.option("--payload", default="full", type=click.Choice(["full", "slim"]))
+@click.option("--mongo", help="MongoDB URI to write to instead of mongomock")
+@click.option("--port", default=8765, help="Port of the mock store")
+@click.option("--json-output", help="Also write the results to this JSON file")
+@click.option("--verbose", is_flag=True, help="Show the output of the imports")
+def main(
+    orders,
+    products,
+    customers,
+    resources,
+    engines,
+    latency,
+    jitter,
+    error_rate,
+    rate_429,
+    shard_size,
+    payload,
+    mongo,
+    port,
+    json_output,
+    verbose,
+):
+    store = MockStore(
+        orders, products, customers, 1, latency, jitter, error_rate, rate_429
+    )
+    server = serve(store, port=port)
+    context = multiprocessing.get_context("spawn")
+
+    rows = []
+    for resource_name in resources or ["orders", "products", "customers"]:
+        resource_engines = engines or ["threads"]
+        if resource_name == "customers":
+            # the customers scan always runs on threads, an async row would
+            # only measure the same threaded scan again
+            resource_engines = ["threads"]
+        for engine in resource_engines:
+            config = {
+                "site": f"http://127.0.0.1:{port}",
+                "mongo": mongo,
+                "database": "woocommerce_benchmark",
+                "resource": resource_name,
+                "engine": engine,
+                "shard_size": shard_size,
+                "payload": payload,
+                "quiet": not verbose,
+            }
+            store.reset()
+            results = context.Queue()
+            process = context.Process(target=run_import, args=(config, results))
+            process.start()
+            # read the result before joining, a child joined while its queue
+            # still holds the result never exits
+            row = None
+            while row is None and process.is_alive():
+                with contextlib.suppress(queue.Empty):
+                    row = results.get(timeout=1)
+            if row is None:
+                # the child may have put the result just before exiting
+                with contextlib.suppress(queue.Empty):
+                    row = results.get(timeout=1)
+            process.join()
+            if row is None:
+                print(f"{resource_name} / {engine} failed (exit {process.exitcode})")
+                continue
+            row["store_requests"] = store.requests
+            rows.append(row)
+
+    server.shutdown()
+
+    print(
+        f'\n{"resource":<11}{"engine":<9}{"records":>9}{"seconds":>9}{"rec/s":>9}'
+        f'{"requests":>10}{"p50 ms":>9}{"p99 ms":>9}{"peak RSS MB":>13}'
+    )
+    for row in rows:
+        print(
+            f'{row["resource"]:<11}{row["engine"]:<9}{row["records"]:>9}'
+            f'{row["seconds"]:>9.2f}{row["records_per_second"]:>9.0f}'
+            f'{row["store_requests"]:>10}{row["p50_ms"]:>9.1f}{row["p99_ms"]:>9.1f}'
+            f'{row["peak_rss_mb"]:>13.1f}'
+        )
+
+    if json_output:
+        with open(json_output, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Local stand-in for the WooCommerce REST API v3 serving seeded synthetic
+orders, products and customers, with configurable latency, errors and 429s
+
+python benchmarks/mock_wc.py --port 8765 --orders 20000 --latency 0.05
+"""
+import json
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import click
+
+START = datetime(2022, 1, 1)
+STATUSES = ["completed", "processing", "on-hold", "refunded", "cancelled"]
+
+
+def _dates(prefix, moment):
+    # the mock store runs on GMT+2
+    return {
+        prefix: (moment + timedelta(hours=2)).isoformat(timespec="seconds"),
+        f"{prefix}_gmt": moment.isoformat(timespec="seconds"),
+    }
+
+
+def _meta_data(rand, count):
+    return [
+        {"id": rand.randrange(10**6), "key": f"_meta_{i}", "value": "x" * 40}
+        for i in range(count)
+    ]
+
+
+def generate(resource, count, seed=1, days=365):
+    """
+    Synthetic records shaped like the WooCommerce responses, spread evenly
+    over `days` days from START and sorted by date_created
+
+    returns: list of records
+    """
+    rand = random.Random(f"{resource}:{seed}")
+    step = days * 86400 / max(count, 1)
+    records = []
+    for i in range(count):
+        created = START + timedelta(seconds=int(i * step + rand.random() * step))
+        modified = created + timedelta(seconds=rand.randrange(0, 30 * 86400))
+        record = {"id": i + 1}
+        record.update(_dates("date_created", created))
+        record.update(_dates("date_modified", modified))
+
+        if resource == "orders":
+            paid = created + timedelta(minutes=rand.randrange(0, 120))
+            record.update(_dates("date_paid", paid))
+            record.update({"date_completed": None, "date_completed_gmt": None})
+            record.update(
+                {
+                    "parent_id": 0,
+                    "number": str(i + 1),
+                    "status": rand.choice(STATUSES),
+                    "currency": "USD",
+                    "total": f"{rand.uniform(5, 500):.2f}",
+                    "customer_id": rand.randrange(1, 5000),
+                    "billing": {"first_name": "Ann", "email": f"c{i}@example.com"},
+                    "line_items": [
+                        {
+                            "id": rand.randrange(10**6),
+                            "product_id": rand.randrange(1, 5000),
+                            "quantity": rand.randrange(1, 5),
+                            "total": f"{rand.uniform(5, 100):.2f}",
+                            "meta_data": _meta_data(rand, 2),
+                        }
+                        for _ in range(rand.randrange(1, 5))
+                    ],
+                    "refunds": [],
+                    "meta_data": _meta_data(rand, rand.randrange(5, 20)),
+                    "_links": {"self": [{"href": f"/wp-json/wc/v3/orders/{i + 1}"}]},
+                }
+            )
+        elif resource == "products":
+            record.update(
+                {
+                    "date_on_sale_from": None,
+                    "date_on_sale_from_gmt": None,
+                    "date_on_sale_to": None,
+                    "date_on_sale_to_gmt": None,
+                    "name": f"Product {i + 1}",
+                    "sku": f"SKU-{i + 1}",
+                    "price": f"{rand.uniform(5, 100):.2f}",
+                    "stock_status": "instock",
+                    "description": "lorem ipsum " * rand.randrange(10, 50),
+                    "images": [],
+                    "meta_data": _meta_data(rand, rand.randrange(2, 10)),
+                }
+            )
+            for n in range(rand.randrange(1, 4)):
+                image = {"id": rand.randrange(10**6), "src": f"/img/{i}-{n}.jpg"}
+                image.update(_dates("date_created", created))
+                image.update(_dates("date_modified", modified))
+                record["images"].append(image)
+        else:
+            record.update(
+                {
+                    "email": f"seller{i + 1}@example.com",
+                    "username": f"seller{i + 1}",
+                    "role": "seller",
+                    "billing": {"first_name": "Ann", "country": "US"},
+                    "meta_data": _meta_data(rand, rand.randrange(2, 10)),
+                }
+            )
+        records.append(record)
+    return records
+
+
+class MockStore:
+    """
+    Records served by the mock, its failure settings and request counts
+
+    params:
+    latency: float - mean seconds added to every response
+    jitter: float - random +/- seconds around the latency
+    error_rate: float - share of requests answered with 503
+    rate_429: float - share of requests answered with 429 and Retry-After
+    """
+
+    def __init__(
+        self,
+        orders=5000,
+        products=1000,
+        customers=1000,
+        seed=1,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        rate_429=0.0,
+    ):
+        self.data = {
+            "orders": generate("orders", orders, seed),
+            "products": generate("products", products, seed),
+            "customers": generate("customers", customers, seed),
+        }
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_429 = rate_429
+        self.rand = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+
+    def query(self, resource, q):
+        """
+        Records of one page and the total for the query parameters
+
+        returns: tuple of (records, total, total pages) or None for a page
+        past the last one
+        """
+        records = self.data[resource]
+        for param, field in [
+            ("after", "date_created"),
+            ("modified_after", "date_modified"),
+        ]:
+            if param in q:
+                field = field + "_gmt" if q.get("dates_are_gmt") == "true" else field
+                records = [r for r in records if r[field] > q[param][:19]]
+        for param, field in [
+            ("before", "date_created"),
+            ("modified_before", "date_modified"),
+        ]:
+            if param in q:
+                field = field + "_gmt" if q.get("dates_are_gmt") == "true" else field
+                records = [r for r in records if r[field] < q[param][:19]]
+        if "role" in q and resource == "customers":
+            records = [r for r in records if r.get("role") == q["role"]]
+
+        orderby = {"id": "id", "modified": "date_modified"}.get(
+            q.get("orderby"), "date_created"
+        )
+        records = sorted(
+            records, key=lambda r: r[orderby], reverse=q.get("order", "desc") == "desc"
+        )
+
+        per_page = min(int(q.get("per_page", 10)), 100)
+        page = int(q.get("page", 1))
+        total = len(records)
+        total_pages = -(-total // per_page)
+        if page > max(total_pages, 1):
+            return None
+        records = records[(page - 1) * per_page : page * per_page]
+        if "_fields" in q:
+            fields = set(q["_fields"].split(","))
+            records = [{k: v for k, v in r.items() if k in fields} for r in records]
+        return records, total, total_pages
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """GET /wp-json/wc/v3/<resource>[/<id>] of the store of the server."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        store = self.server.store
+        with store.lock:
+            store.requests += 1
+            roll = store.rand.random()
+            delay = max(
+                store.latency + store.rand.uniform(-store.jitter, store.jitter), 0
+            )
+        if delay:
+            time.sleep(delay)
+
+        if roll < store.rate_429:
+            self._reply(429, {"code": "too_many_requests"}, {"Retry-After": "1"})
+            return
+        if roll < store.rate_429 + store.error_rate:
+            self._reply(503, {"code": "unavailable"})
+            return
+
+        url = urlparse(self.path)
+        q = {key: values[0] for key, values in parse_qs(url.query).items()}
+        parts = url.path.split("/wc/v3/")[-1].strip("/").split("/")
+        resource = parts[0]
+        if resource not in store.data:
+            self._reply(404, {"code": "rest_no_route"})
+            return
+
+        if len(parts) > 1:
+            matches = [r for r in store.data[resource] if str(r["id"]) == parts[1]]
+            if matches:
+                self._reply(200, matches[0])
+            else:
+                self._reply(404, {"code": "woocommerce_rest_invalid_id"})
+            return
+
+        result = store.query(resource, q)
+        if result is None:
+            self._reply(400, {"code": "rest_post_invalid_page_number"})
+            return
+        records, total, total_pages = result
+        headers = {"X-WP-Total": str(total), "X-WP-TotalPages": str(total_pages)}
+        self._reply(200, records, headers)
+
+    def _reply(self, status_code, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status_code)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients drop idle keep-alive connections, that is not an error
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def serve(store, host="127.0.0.1", port=8765):
+    """
+    Start serving the store on a background thread
+
+    returns: the server, stop it with shutdown()
+    """
+    server = MockServer((host, port), MockHandler)
+    server.store = store
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@click.command()
+@click.option("--port", default=8765, help="Port to listen on")
+@click.option("--orders", default=5000, help="Number of orders")
+@click.option("--products", default=1000, help="Number of products")
+@click.option("--customers", default=1000, help="Number of customers")
+@click.option("--seed", default=1, help="Seed of the generated records")
+@click.option("--latency", default=0.0, help="Mean seconds added to responses")
+@click.option("--jitter", default=0.0, help="Random +/- seconds around the latency")
+@click.option("--error-rate", default=0.0, help="Share of 503 responses")
+@click.option("--rate-429", default=0.0, help="Share of 429 responses")
+def main(
+    port, orders, products, customers, seed, latency, jitter, error_rate, rate_429
+):
+    store = MockStore(
+        orders, products, customers, seed, latency, jitter, error_rate, rate_429
+    )
+    server = serve(store, port=port)
+    print(f"Mock store on http://127.0.0.1:{port} (SITE), Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Module to remember which pages of an import run are written, so an
+interrupted run can be resumed without fetching them again
+"""
+import json
+import os
+import threading
+from datetime import datetime
+from config import APP, DB
+from connections import db
+
+
+class Checkpoint:
+    """
+    Pages of one import run whose records have been written, kept in the
+    checkpoint collection or in a local file when CHECKPOINT_FILE is set
+
+    params:
+    run: str - identifies the run, e.g. resource, date range and sort
+    path: str - local file to keep the checkpoints in instead of MongoDB
+    """
+
+    def __init__(self, run, path=APP.CHECKPOINT_FILE):
+        self.run = run
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = self._load()
+
+    @staticmethod
+    def key(task):
+        """Stable key of a page from its query parameters."""
+        return json.dumps(task, sort_keys=True)
+
+    def _load(self):
+        if not self.path:
+            entries = db[DB.CHECKPOINT_COLLECTION].find(
+                {"run": self.run}, projection={"page": True, "_id": False}
+            )
+            return {entry["page"] for entry in entries}
+
+        if not os.path.exists(self.path):
+            return set()
+        with open(self.path) as f:
+            entries = (json.loads(line) for line in f if line.strip())
+            return {entry["page"] for entry in entries if entry["run"] == self.run}
+
+    def is_done(self, task):
+        return self.key(task) in self.done
+
+    def mark_done(self, tasks):
+        """Record pages as done, called only after their writes are acknowledged."""
+        pages = [self.key(task) for task in tasks]
+        entries = [
+            {"run": self.run, "page": page, "done_at": datetime.now()} for page in pages
+        ]
+        with self.lock:
+            if not self.path:
+                db[DB.CHECKPOINT_COLLECTION].insert_many(entries)
+            else:
+                with open(self.path, "a") as f:
+                    for entry in entries:
+                        entry["done_at"] = entry["done_at"].isoformat()
+                        f.write(json.dumps(entry) + "\n")
+            self.done.update(pages)
+
+    def clear(self):
+        """Forget every page of the run."""
+        with self.lock:
+            if not self.path:
+                db[DB.CHECKPOINT_COLLECTION].delete_many({"run": self.run})
+            elif os.path.exists(self.path):
+                with open(self.path) as f:
+                    entries = [json.loads(line) for line in f if line.strip()]
+                with open(self.path, "w") as f:
+                    for entry in entries:
+                        if entry["run"] != self.run:
+                            f.write(json.dumps(entry) + "\n")
+            self.done = set()
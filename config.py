@@ -15,12 +15,73 @@ else:
 
 class APP:
     MAX_THREADS = int(os.getenv("MAX_THREADS", 10))
+    # transport level retries for connection and gateway errors
+    HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", 3))
+    WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 100))
+    # directory to save the raw fetched pages in for --from-cache
+    PAGE_CACHE_DIR = os.getenv("PAGE_CACHE_DIR")
+    # processes decoding cached pages (0 for one per CPU core)
+    CACHE_PROCESSES = int(os.getenv("CACHE_PROCESSES", 0))
+    # records per row group of Parquet exports
+    EXPORT_ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", 10000))
+    # export OpenMetrics to this file and/or on this local port
+    METRICS_FILE = os.getenv("METRICS_FILE")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", 0))
+    # --profile: seconds between stack samples and prefix of the files written
+    PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.01))
+    PROFILE_OUTPUT = os.getenv("PROFILE_OUTPUT", "profile")
+    # seconds between rewrites of the --metrics-file
+    METRICS_INTERVAL = int(os.getenv("METRICS_INTERVAL", 10))
+    # worker mode: seconds a claimed shard is held without a heartbeat,
+    # claims of a shard before it is left failed, customers pages per shard
+    # and seconds between looks for shards while others are running
+    JOB_LEASE = int(os.getenv("JOB_LEASE", 300))
+    JOB_ATTEMPTS = int(os.getenv("JOB_ATTEMPTS", 3))
+    JOB_PAGES = int(os.getenv("JOB_PAGES", 20))
+    JOB_POLL_INTERVAL = int(os.getenv("JOB_POLL_INTERVAL", 10))
+    # create missing indexes before importing (0 to only report them)
+    CREATE_INDEXES = int(os.getenv("CREATE_INDEXES", 1))
+    # ids read per round trip when loading the ids already in the database
+    ID_BATCH_SIZE = int(os.getenv("ID_BATCH_SIZE", 10000))
+    # fields requested and stored: "full" or "slim" (see profiles.py)
+    PAYLOAD_PROFILE = os.getenv("PAYLOAD_PROFILE", "full")
+    # distinct date strings kept parsed
+    DATE_CACHE_SIZE = int(os.getenv("DATE_CACHE_SIZE", 65536))
+    # records per date window when imports are sharded (0 = offset pages)
+    SHARD_SIZE = int(os.getenv("SHARD_SIZE", 0))
+    # threads per pipeline stage and the number of pages each queue can hold
+    FETCH_THREADS = int(os.getenv("FETCH_THREADS", MAX_THREADS))
+    TRANSFORM_THREADS = int(os.getenv("TRANSFORM_THREADS", 2))
+    WRITE_THREADS = int(os.getenv("WRITE_THREADS", 2))
+    QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", MAX_THREADS * 2))
+    # requests in flight at once with the async engine
+    ASYNC_CONCURRENCY = int(os.getenv("ASYNC_CONCURRENCY", 100))
+    # attempts per page before it is written to the dead-letter file, with
+    # jittered exponential backoff (seconds) between attempts
+    PAGE_ATTEMPTS = int(os.getenv("PAGE_ATTEMPTS", 5))
+    RETRY_BACKOFF = float(os.getenv("RETRY_BACKOFF", 1))
+    RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", 60))
+    # seconds between polls of the watch command
+    WATCH_ORDERS_INTERVAL = int(os.getenv("WATCH_ORDERS_INTERVAL", 60))
+    WATCH_PRODUCTS_INTERVAL = int(os.getenv("WATCH_PRODUCTS_INTERVAL", 300))
+    WATCH_CUSTOMERS_INTERVAL = int(os.getenv("WATCH_CUSTOMERS_INTERVAL", 3600))
+    # webhook receiver: seconds between bulk writes of pushed records and
+    # between reconciling polls of orders and products
+    WEBHOOK_FLUSH_INTERVAL = float(os.getenv("WEBHOOK_FLUSH_INTERVAL", 2))
+    WEBHOOK_RECONCILE_INTERVAL = int(os.getenv("WEBHOOK_RECONCILE_INTERVAL", 3600))
+    DEAD_LETTER_FILE = os.getenv("DEAD_LETTER_FILE", "failed_pages.ndjson")
+    # keep import checkpoints in this file instead of MongoDB
+    CHECKPOINT_FILE = os.getenv("CHECKPOINT_FILE")
+    # adaptive concurrency starts here and grows up to the number of fetchers
+    INITIAL_CONCURRENCY = int(os.getenv("INITIAL_CONCURRENCY", 4))
+    LATENCY_TOLERANCE = float(os.getenv("LATENCY_TOLERANCE", 2.5))
 
 
 class WC:
     STORE_URL = os.getenv("SITE")
     CONSUMER_KEY = os.getenv("consumer_key")
     CONSUMER_SECRET = os.getenv("consumer_secret")
+    WEBHOOK_SECRET = os.getenv("webhook_secret")
 
 
 class DB:
@@ -29,3 +90,6 @@ class DB:
     ORDER_COLLECTION = os.getenv("ORDER_COLLECTION", "orders")
     CUSTOMER_COLLECTION = os.getenv("CUSTOMER_COLLECTION", "vendors")
     PRODUCT_COLLECTION = os.getenv("PRODUCT_COLLECTION", "products")
+    META_COLLECTION = os.getenv("META_COLLECTION", "migration_meta")
+    CHECKPOINT_COLLECTION = os.getenv("CHECKPOINT_COLLECTION", "migration_checkpoints")
+    JOBS_COLLECTION = os.getenv("JOBS_COLLECTION", "jobs")
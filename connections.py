@@ -1,17 +1,216 @@
+import json
+import threading
+import time
+from urllib.parse import urlencode
+from requests import Session
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from woocommerce import API
+from woocommerce.oauth import OAuth
 from pymongo import MongoClient
-from config import WC, DB
+from config import APP, WC, DB
+from throttle import limiter
+import metrics
 
 
-wcapi = API(
-    url=WC.STORE_URL,
-    consumer_key=WC.CONSUMER_KEY,
-    consumer_secret=WC.CONSUMER_SECRET,
-    version="wc/v3",
-    timeout=120,
-)
+class PooledAPI(API):
+    """
+    WooCommerce API client that sends every request through one shared
+    requests Session, so worker threads reuse pooled keep-alive connections
+    instead of paying a new TCP and TLS handshake for each page. Requests
+    wait on the adaptive limiter of throttle.py shared by all importers
+    and engines.
+    """
 
-client = MongoClient(DB.MONGO_URI)
-db = client[DB.NAME]
+    def __init__(self, url, consumer_key, consumer_secret, pool_size=10, **kwargs):
+        super().__init__(url, consumer_key, consumer_secret, **kwargs)
 
-client.server_info()  # authenticate first to check for auth errors before running the script
+        # retry connection errors and gateway errors a few times at the
+        # transport level, backing off between attempts. 429 and 503 are
+        # returned as they are so the limiter sees the server is overloaded
+        retry = Retry(
+            total=APP.HTTP_RETRIES,
+            backoff_factor=0.5,
+            status_forcelist=(502, 504),
+            allowed_methods=frozenset(["GET"]),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            pool_block=True,
+            max_retries=retry,
+        )
+        self.session = Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(
+            {
+                "user-agent": self.user_agent,
+                "accept": "application/json",
+                "accept-encoding": "gzip, deflate",
+                "connection": "keep-alive",
+            }
+        )
+
+    def request_args(self, endpoint, params, method="GET"):
+        """
+        Build the url, query parameters and basic auth for a request
+        authenticated the same way as the woocommerce API client
+
+        returns: tuple of url, params and (consumer_key, consumer_secret) or None
+        """
+        url = self.url if self.url.endswith("/") else f"{self.url}/"
+        api = "wp-json" if self.wp_api else "wc-api"
+        url = f"{url}{api}/{self.version}/{endpoint}"
+
+        if self.is_ssl and not self.query_string_auth:
+            return url, params, (self.consumer_key, self.consumer_secret)
+        if self.is_ssl:
+            params = dict(
+                params,
+                consumer_key=self.consumer_key,
+                consumer_secret=self.consumer_secret,
+            )
+            return url, params, None
+
+        # plain http needs the request signed with OAuth 1.0a
+        oauth = OAuth(
+            url=f"{url}?{urlencode(params)}",
+            consumer_key=self.consumer_key,
+            consumer_secret=self.consumer_secret,
+            version=self.version,
+            method=method,
+        )
+        return oauth.get_oauth_url(), None, None
+
+    def _API__request(self, method, endpoint, data, params=None, **kwargs):
+        """Send the request through the shared session (overrides API.__request)."""
+        url, params, auth = self.request_args(endpoint, params or {}, method)
+        headers = {}
+        if data is not None:
+            data = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            headers["content-type"] = "application/json;charset=utf-8"
+
+        limiter.acquire()
+        started = time.monotonic()
+        cpu_started = time.thread_time()
+        response = None
+        try:
+            response = self.session.request(
+                method=method,
+                url=url,
+                verify=self.verify_ssl,
+                auth=auth,
+                params=params,
+                data=data,
+                timeout=self.timeout,
+                headers=headers,
+                **kwargs,
+            )
+        finally:
+            elapsed = time.monotonic() - started
+            resource = endpoint.split("/")[0]
+            metrics.observe("http_request_seconds", elapsed, resource=resource)
+            cpu = time.thread_time() - cpu_started
+            metrics.inc(
+                "cpu_seconds", cpu, stage="http_request_seconds", resource=resource
+            )
+            if response is None:
+                limiter.release(elapsed)
+            else:
+                limiter.release(
+                    elapsed, response.status_code, response.headers.get("Retry-After")
+                )
+                # the body is decompressed by now, Content-Length is the size
+                # sent over the wire
+                received = response.headers.get("Content-Length")
+                if received and received.isdigit():
+                    received = int(received)
+                else:
+                    received = len(response.content)
+                metrics.inc("http_received_bytes", received, resource=resource)
+        return response
+
+
+class Connections:
+    """
+    Creates the WooCommerce and MongoDB clients the first time they are
+    used, so importing the modules (or running --help) opens no connection
+
+    Tests can hand in their own clients with use() before anything is
+    imported from the database or the store.
+    """
+
+    def __init__(self):
+        self._wcapi = None
+        self._client = None
+        self._db = None
+        self.lock = threading.Lock()
+
+    @property
+    def wcapi(self):
+        with self.lock:
+            if self._wcapi is None:
+                self._wcapi = PooledAPI(
+                    url=WC.STORE_URL,
+                    consumer_key=WC.CONSUMER_KEY,
+                    consumer_secret=WC.CONSUMER_SECRET,
+                    version="wc/v3",
+                    timeout=120,
+                    pool_size=max(APP.MAX_THREADS, APP.FETCH_THREADS),
+                )
+            return self._wcapi
+
+    @property
+    def client(self):
+        with self.lock:
+            if self._client is None:
+                client = MongoClient(DB.MONGO_URI)
+                client.server_info()  # authenticate first to check for auth errors before running the script
+                self._client = client
+            return self._client
+
+    @property
+    def db(self):
+        if self._db is None:
+            client = self.client
+            with self.lock:
+                if self._db is None:
+                    self._db = client[DB.NAME]
+        return self._db
+
+    def use(self, wcapi=None, client=None, db=None):
+        """Use the given clients instead of creating them."""
+        with self.lock:
+            if wcapi is not None:
+                self._wcapi = wcapi
+            if client is not None:
+                self._client = client
+                self._db = None if db is None else db
+            elif db is not None:
+                self._db = db
+
+
+class _Lazy:
+    """Stands in for one client of the provider until it is first used."""
+
+    def __init__(self, name):
+        self._name = name
+
+    def _target(self):
+        return getattr(provider, self._name)
+
+    def __getattr__(self, attr):
+        return getattr(self._target(), attr)
+
+    def __getitem__(self, key):
+        return self._target()[key]
+
+
+provider = Connections()
+
+# the modules import these once and use them as the real clients
+wcapi = _Lazy("wcapi")
+db = _Lazy("db")
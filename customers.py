@@ -2,172 +2,254 @@
 Module to import all customers or specific customer from WooCommerce
 """
 import concurrent.futures
-from tqdm import tqdm
+from functools import partial
 from dateutil import parser as dateparser
 from config import APP, DB
 from connections import wcapi, db
+from checkpoints import Checkpoint
+from pipeline import get_page
+from failed_pages import record_failed_page
+from writer import WriteResult, bulk_upsert
+from dates import CUSTOMER_DATES
+from id_index import IdIndex, find_ids
+import importing
+import metrics
+import profiles
 
-MAX_THREADS = APP.MAX_THREADS
 max_customer_per_page = 100
 
-# list of customer ids that are in the database currently
-customers_in_db = set()
-
-num_of_written_records = 0
-num_of_skipped_records = 0
+# ids of the customers in the range that are in the database (sync mode)
+customers_in_db = IdIndex()
 
 
 def get_customers_in_db(from_date, to_date):
-    """Get all customers in the range given that are in the database."""
+    """Get the ids of all customers in the range given that are in the database."""
     # Mongo friendly datetime
     from_date = dateparser.isoparse(from_date)
     to_date = dateparser.isoparse(to_date)
-    results = db[DB.CUSTOMER_COLLECTION].find(
+    return find_ids(
+        db[DB.CUSTOMER_COLLECTION],
         {"date_created": {"$gte": from_date, "$lte": to_date}},
     )
-    return results
 
 
-def import_all_customers(sort, from_date, to_date, sync=False):
+def import_all_customers(sort, from_date, to_date, sync=False, resume=False):
     """
     Import all customers having seller role
 
+    The pages are fetched by the scan on threads, how far it goes depends on
+    the pages already fetched so it does not run on the async engine.
+
     params:
-    sort: str - Sort customers ascending or descending.
+    sort: str - Sort customers ascending or descending (they are fetched
+    newest first either way, so the fetch can stop at from_date)
     from_date: str - import customers created starting from this date
     to_date: str - import customers created untill this date
+    resume: bool - skip pages written by an earlier run of the same range
 
     returns: list of customers have seller role
     """
-    global num_of_skipped_records, num_of_written_records
-
     if sync == True:
-        # get all customers that are in the database first
-        results = get_customers_in_db(from_date, to_date)
-        for order in results:
-            customers_in_db.add(order.get("id"))
+        # get the ids of all customers that are in the database first
+        customers_in_db.load(get_customers_in_db(from_date, to_date))
+    else:
+        customers_in_db.clear()
 
     print("Customers found in DB: ", len(customers_in_db))
 
-    page = 1
-    initial_customers = wcapi.get(
+    checkpoint = Checkpoint(f"customers:{from_date}:{to_date}:{sort}")
+    if resume:
+        print(f"Pages already imported: {len(checkpoint.done)}\n")
+    else:
+        checkpoint.clear()
+
+    # the API has no date filter for customers, so scan them newest first
+    # and stop at the first page that reaches past from_date
+    scan_failures = WriteResult()
+    pages = scan_pages(from_date, to_date, scan_failures, checkpoint)
+    summary = import_pages(
+        (), None, from_date, to_date, checkpoint=checkpoint, prefetched=pages
+    )
+    summary += scan_failures
+    summary.print_summary()
+
+    if not summary.failed and not summary.failed_pages:
+        # the whole range is imported, nothing is left to resume
+        checkpoint.clear()
+
+
+def retry_failed_customers(path, engine="threads"):
+    """
+    Fetch again the pages of customers recorded in a dead-letter file, each
+    filtered by the date range its page was imported for
+
+    params:
+    path: str - dead-letter file written by a previous import
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    importing.retry_failed(
+        "customers", process_customers, DB.CUSTOMER_COLLECTION, path, engine
+    )
+
+
+def import_cached_customers():
+    """
+    Transform and write again the pages of customers saved in the page cache
+
+    The pages are not filtered by registration date, every cached customer
+    is written.
+    """
+    customers_in_db.clear()
+    importing.import_cached(
         "customers",
-        params={
-            "per_page": max_customer_per_page,
-            "page": page,
-            "role": "seller",
-        },
+        partial(process_customers, from_date=None, to_date=None),
+        DB.CUSTOMER_COLLECTION,
     )
 
-    total_pages = initial_customers.headers.get("X-WP-TotalPages", 0)
-    print(f"Total pages: {total_pages}\n")
-    pages = range(1, int(total_pages) + 1)
-
-    # use multi-threading to pull multiple customers concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        future_to_customer = {
-            executor.submit(get_customers, page, sort, from_date, to_date): page
-            for page in pages
-        }
-        for future in tqdm(
-            concurrent.futures.as_completed(future_to_customer),
-            total=int(total_pages),
-            unit="page",
-        ):
-            try:
-                status = future.result()
-            except:
-                pass
-
-    print(f'\n\n{"-" * 50}')
-    print(f"Newly inserted records: {num_of_written_records}")
-    print(f"Skipped records: {num_of_skipped_records}\n")
-
-
-def get_customers(page, sort, from_date, to_date):
-    """Get customers on a specific page."""
+
+def import_pages(
+    tasks,
+    total,
+    from_date,
+    to_date,
+    engine="threads",
+    dead_letter=APP.DEAD_LETTER_FILE,
+    checkpoint=None,
+    prefetched=(),
+):
+    """Fetch, process and write the pages of customers given by their query params."""
+    return importing.import_pages(
+        "customers",
+        process_customers,
+        DB.CUSTOMER_COLLECTION,
+        tasks,
+        total,
+        engine,
+        dead_letter=dead_letter,
+        checkpoint=checkpoint,
+        prefetched=prefetched,
+        context={"from_date": from_date, "to_date": to_date},
+    )
+
+
+def scan_pages(from_date, to_date, failures, checkpoint=None):
+    """
+    Get the pages of sellers newest registration first, until a page reaches
+    customers registered before from_date
+
+    Pages are fetched in waves that double in size up to FETCH_THREADS, so a
+    short range costs a request or two and a long one runs in parallel.
+
+    params:
+    failures: WriteResult - pages that could not be fetched are counted in
+    its failed_pages
+
+    returns: generator of (page params, customers)
+    """
+    page = 1
+    wave = 1
+    total_pages = None
+    context = {"from_date": from_date, "to_date": to_date}
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=APP.FETCH_THREADS
+    ) as executor:
+        while total_pages is None or page <= total_pages:
+            last = page + wave
+            if total_pages is not None:
+                last = min(last, total_pages + 1)
+            tasks = [
+                page_params(p, "desc", from_date, to_date) for p in range(page, last)
+            ]
+            responses = list(executor.map(partial(scan_page, context=context), tasks))
+            failures.failed_pages += responses.count(None)
+            if all(response is None for response in responses):
+                print("No page of the wave could be fetched, stopping (use --resume)")
+                return
+
+            for task, response in zip(tasks, responses):
+                if response is None:
+                    continue
+                total_pages = int(response.headers.get("X-WP-TotalPages", 0))
+                records = response.json()
+                if not checkpoint or not checkpoint.is_done(task):
+                    yield task, records
+                if not records or records[-1]["date_created"] < from_date:
+                    return  # older pages are all out of range
+
+            page = last
+            wave = min(wave * 2, APP.FETCH_THREADS)
+
+
+def scan_page(task, context):
+    """Get one page of the scan, recording it as failed if it cannot be fetched."""
     try:
-        response = wcapi.get(
-            "customers",
-            params={
-                "per_page": max_customer_per_page,
-                "page": page,
-                "order": sort,
-                "role": "seller",
-            },
-        )
-        if response.status_code != 200:
-            print(f"Error status code {response.status_code} for page {page}")
-        else:
-            customers = tuple(response.json())
-            for customer in customers:
-                process_customer(customer, from_date, to_date)
-
-            customers = None  # clear previous values to free up memory
-            return True
+        return get_page("customers", task)
     except Exception as e:
-        print(f"Unexpected Error: {e}")
-    return False
+        print(f"{e} for page {task['page']}")
+        record_failed_page(APP.DEAD_LETTER_FILE, "customers", task, context, e)
+        metrics.inc("failed_pages", resource="customers")
+    return None
 
 
-def process_customer(customer, from_date, to_date):
+def page_params(page, sort, from_date, to_date):
+    """Query parameters to request a specific page of customers."""
+    return {
+        "per_page": max_customer_per_page,
+        "page": page,
+        "orderby": "registered_date",
+        "order": sort,
+        "role": "seller",
+    }
+
+
+def process_customers(records, from_date, to_date):
     """
-    Process customer to convert date and times to datetime objects
-    and import customers created between the specified date
+    Process a page of customers and leave out the ones already in the database
+
+    returns: tuple of processed customers and number of skipped customers
+    """
+    customers = []
+    skipped = 0
+    for customer in records:
+        customer = process_customer(customer, from_date, to_date)
+        if not customer:
+            continue
+        if customer["id"] in customers_in_db:
+            # print(f"Customer id: {customer['id']} found in db (skipping)")
+            skipped += 1
+            continue
+        customers.append(customer)
+
+    return customers, skipped
+
+
+def process_customer(customer, from_date=None, to_date=None):
     """
-    global num_of_skipped_records, num_of_written_records
+    Process customer to convert date and times to datetime objects
+    if it was created between the specified date (any date if not given)
 
+    returns: processed customer or None if it is out of range or has no id
+    """
     if not customer.get("id", None):
         print("No customer id skipping")
-        return
+        return None
+
+    customer = profiles.trim("customers", customer)
+
+    if from_date and to_date:
+        if not from_date <= customer["date_created"] <= to_date:
+            return None
+
+    customer = CUSTOMER_DATES(customer)
 
-    if from_date <= customer["date_created"] <= to_date:
-        date_fields = [
-            "date_created",
-            "date_created_gmt",
-            "date_modified",
-            "date_modified_gmt",
-        ]
-        for field in date_fields:
-            if field not in customer:
-                continue
-            str_date = customer[field]
-            if not str_date:
-                continue
-            customer[field] = dateparser.isoparse(str_date)
-
-        customer_id = customer.get("id")
-        if customer_id not in customers_in_db:
-            db[DB.CUSTOMER_COLLECTION].find_one_and_replace(
-                filter={"id": customer_id}, replacement=customer, upsert=True
-            )
-            num_of_written_records += 1
-        else:
-            # print(f"Customer id: {customer_id} found in db (skipping)")
-            num_of_skipped_records += 1
+    return customer
 
 
 def get_customer(id):
     """Get specific customer specified by ID."""
-    customer = wcapi.get(f"customers/{id}").json()
-    if not customer.get("id", None):
-        print("No customer id skipping")
+    params = profiles.with_fields("customers", {})
+    customer = process_customer(wcapi.get(f"customers/{id}", params=params).json())
+    if not customer:
         return
 
-    date_fields = [
-        "date_created",
-        "date_created_gmt",
-        "date_modified",
-        "date_modified_gmt",
-    ]
-    for field in date_fields:
-        if field not in customer:
-            continue
-        str_date = customer[field]
-        if not str_date:
-            continue
-        customer[field] = dateparser.isoparse(str_date)
-
-    db[DB.CUSTOMER_COLLECTION].find_one_and_replace(
-        filter={"id": customer.get("id")}, replacement=customer, upsert=True
-    )
+    bulk_upsert(db[DB.CUSTOMER_COLLECTION], [customer])
@@ -0,0 +1,96 @@
+"""
+Module to convert the ISO 8601 date strings of WooCommerce records to
+datetime objects, with the date fields of each resource listed once
+"""
+from datetime import datetime
+from functools import lru_cache
+from dateutil import parser as dateparser
+from config import APP
+
+
+@lru_cache(maxsize=APP.DATE_CACHE_SIZE)
+def parse_date(value):
+    """
+    Parse an ISO 8601 date string
+
+    datetime.fromisoformat is much faster than dateutil and reads the
+    dates WooCommerce returns; anything it rejects falls back to dateutil.
+    Records share many timestamps (local and GMT of the same moment,
+    created and modified), so results are cached.
+    """
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return dateparser.isoparse(value)
+
+
+class DateConverter:
+    """
+    Converts the date fields of a record in place
+
+    params:
+    fields: list - top level date fields
+    nested: dict - key of a list of sub records -> DateConverter for them
+    """
+
+    def __init__(self, fields, nested=None):
+        self.fields = tuple(fields)
+        self.nested = tuple((nested or {}).items())
+
+    def __call__(self, record):
+        for field in self.fields:
+            value = record.get(field)
+            if value and isinstance(value, str):
+                record[field] = parse_date(value)
+
+        for key, convert in self.nested:
+            for item in record.get(key) or ():
+                convert(item)
+        return record
+
+
+ORDER_DATES = DateConverter(
+    [
+        "date_created",
+        "date_created_gmt",
+        "date_modified",
+        "date_modified_gmt",
+        "date_paid",
+        "date_paid_gmt",
+        "date_completed",
+        "date_completed_gmt",
+    ],
+    nested={"refunds": DateConverter(["date_created", "date_created_gmt"])},
+)
+
+PRODUCT_DATES = DateConverter(
+    [
+        "date_created",
+        "date_created_gmt",
+        "date_modified",
+        "date_modified_gmt",
+        "date_on_sale_from",
+        "date_on_sale_from_gmt",
+        "date_on_sale_to",
+        "date_on_sale_to_gmt",
+    ],
+    nested={
+        "images": DateConverter(
+            [
+                "date_created",
+                "date_created_gmt",
+                "date_modified",
+                "date_modified_gmt",
+            ]
+        )
+    },
+)
+
+CUSTOMER_DATES = DateConverter(
+    [
+        "date_created",
+        "date_created_gmt",
+        "date_modified",
+        "date_modified_gmt",
+    ]
+)
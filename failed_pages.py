@@ -0,0 +1,81 @@
+"""
+Module to keep pages that could not be fetched in a dead-letter file
+(one JSON object per line) so they can be fetched again later
+"""
+import json
+import os
+import threading
+from datetime import datetime
+
+lock = threading.Lock()
+
+
+def record_failed_page(path, resource, params, context=None, error=None):
+    """
+    Append a page that failed every attempt to the dead-letter file
+
+    params:
+    path: str - dead-letter file
+    resource: str - WooCommerce endpoint, e.g. "orders"
+    params: dict - query parameters of the page
+    context: dict - extra values needed to process the page again
+    error: Exception - the last error
+    """
+    entry = {
+        "resource": resource,
+        "params": params,
+        "context": context or {},
+        "error": str(error),
+        "failed_at": datetime.now().isoformat(),
+    }
+    line = json.dumps(entry, default=str)
+    try:
+        with lock:
+            with open(path, "a") as f:
+                f.write(line + "\n")
+    except OSError as e:
+        # a failed import must still finish, print the entry to keep it
+        print(f"{e} while writing the dead-letter file, failed page: {line}")
+
+
+def read_failed_pages(path, resource):
+    """
+    Pages of a resource in the dead-letter file
+
+    They stay in the file until remove_failed_pages is called once they are
+    fetched again, so an interrupted retry loses none of them.
+
+    returns: list of dead-letter entries for the resource
+    """
+    with lock:
+        if not os.path.exists(path):
+            return []
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+    return [entry for entry in entries if entry["resource"] == resource]
+
+
+def remove_failed_pages(path, taken):
+    """
+    Remove retried entries from the dead-letter file
+
+    Pages that failed again were appended back by the retry as new entries
+    and are kept. The file is replaced whole, so a crash leaves either the
+    old or the new file.
+
+    params:
+    path: str - dead-letter file
+    taken: list - entries returned by read_failed_pages
+    """
+    with lock:
+        if not os.path.exists(path):
+            return
+        with open(path) as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+        remaining = [entry for entry in entries if entry not in taken]
+        temporary = f"{path}.tmp"
+        with open(temporary, "w") as f:
+            for entry in remaining:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(temporary, path)
@@ -0,0 +1,153 @@
+"""
+Module with the import steps every resource shares: running pages through
+the pipeline, fetching dead-letter pages again, replaying the page cache
+and incremental imports by modified date. The resource modules pass in
+their page params, transform and collection.
+"""
+import json
+from datetime import datetime, timedelta
+from functools import partial
+from config import APP
+from connections import db
+from async_fetch import AsyncPipeline
+from pipeline import KeysetPages, Pipeline
+from failed_pages import read_failed_pages, remove_failed_pages
+from watermarks import get_watermark, set_watermark
+from writer import WriteResult, bulk_upsert
+import page_cache
+import sinks
+
+
+def import_pages(
+    resource,
+    transform,
+    collection,
+    tasks,
+    total,
+    engine="threads",
+    dead_letter=APP.DEAD_LETTER_FILE,
+    checkpoint=None,
+    prefetched=(),
+    context=None,
+):
+    """
+    Fetch, process and write the pages of a resource given by their query
+    params, and the (params, records) of pages already fetched
+
+    params:
+    resource: str - WooCommerce endpoint, e.g. "orders"
+    transform: callable(records, **context) - returns (processed records,
+    skipped count)
+    collection: str - name of the MongoDB collection to write to
+    context: dict - keyword arguments of transform, saved with failed pages
+
+    returns: WriteResult
+    """
+    if context:
+        transform = partial(transform, **context)
+    # fetch pages, process and write them on separate pipeline stages
+    pipeline_class = AsyncPipeline if engine == "async" else Pipeline
+    pipeline = pipeline_class(
+        resource,
+        transform=transform,
+        write=sinks.with_exports(partial(bulk_upsert, db[collection])),
+        context=context,
+        dead_letter=dead_letter,
+        checkpoint=checkpoint,
+    )
+    return pipeline.run(tasks, total=total, prefetched=prefetched)
+
+
+def retry_failed(resource, transform, collection, path, engine="threads"):
+    """
+    Fetch again the pages of a resource recorded in a dead-letter file, each
+    processed with the context it was recorded with
+
+    params:
+    path: str - dead-letter file written by a previous import
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    failed = read_failed_pages(path, resource)
+    print(f"Failed pages found: {len(failed)}\n")
+
+    groups = {}
+    for entry in failed:
+        key = json.dumps(entry["context"], sort_keys=True)
+        groups.setdefault(key, (entry["context"], []))[1].append(entry["params"])
+
+    summary = WriteResult()
+    for context, tasks in groups.values():
+        summary += import_pages(
+            resource,
+            transform,
+            collection,
+            tasks,
+            len(tasks),
+            engine,
+            dead_letter=path,
+            context=context,
+        )
+    # pages that failed again were appended back as new entries
+    remove_failed_pages(path, failed)
+    summary.print_summary()
+
+
+def import_cached(resource, transform, collection):
+    """Transform and write again the pages of a resource saved in the page cache."""
+    summary = page_cache.replay(
+        resource,
+        transform,
+        # cached pages of different runs overlap and are replayed in no
+        # particular order, so an older version never replaces a newer one
+        sinks.with_exports(partial(bulk_upsert, db[collection], newer_only=True)),
+    )
+    summary.print_summary()
+
+
+def import_modified(
+    resource,
+    transform,
+    collection,
+    page_params,
+    per_page,
+    from_date=None,
+    engine="threads",
+):
+    """
+    Import the records modified since the newest one imported by the previous
+    incremental import, and move the watermark forward
+
+    params:
+    page_params: callable(page, modified_after) - query parameters of a page
+    per_page: int - number of records on a full page
+    from_date: str - GMT datetime to start from when there is no watermark yet
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    watermark = get_watermark(resource)
+    if watermark:
+        # start a second early for records modified in the watermark's second
+        # after the previous query ran (unchanged ones are not written again)
+        modified_after = watermark - timedelta(seconds=1)
+    elif from_date:
+        modified_after = datetime.fromisoformat(from_date)
+    else:
+        print("No previous incremental import found, use --after to set the start")
+        return
+
+    print(
+        f"Importing {resource} modified after '{modified_after.isoformat()}' (GMT)...\n"
+    )
+    # each page starts after the last record of the one before, so records
+    # modified meanwhile cannot shift others onto pages already fetched
+    pages = KeysetPages(resource, page_params, modified_after, per_page)
+    summary = import_pages(
+        resource, transform, collection, (), None, engine, prefetched=pages
+    )
+    summary.print_summary()
+
+    # a failed page or record may be older than the newest one written
+    if pages.failed or summary.failed or summary.failed_pages:
+        print(f"Some {resource} failed, the watermark was not moved")
+    elif summary.last_modified:
+        set_watermark(resource, summary.last_modified)
+        print(f"Watermark moved to '{summary.last_modified.isoformat()}' (GMT)")
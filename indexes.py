@@ -0,0 +1,66 @@
+"""
+Module to create the MongoDB indexes the imports rely on: the upserts look
+records up by `id` and the sync mode reads a `date_created` range
+"""
+from pymongo import ASCENDING
+from pymongo.errors import OperationFailure
+from config import DB
+from connections import db
+
+# field -> whether the index is unique, for each collection of records
+INDEXES = {"id": True, "date_created": False, "date_modified": False}
+
+
+def record_collections():
+    return [DB.ORDER_COLLECTION, DB.PRODUCT_COLLECTION, DB.CUSTOMER_COLLECTION]
+
+
+def missing_indexes():
+    """
+    Indexes of INDEXES that the collections do not have yet
+
+    returns: list of (collection name, field, unique)
+    """
+    missing = []
+    for name in record_collections():
+        # an index leading with the field serves the lookups as well
+        existing = {}
+        for info in db[name].index_information().values():
+            field = info["key"][0][0]
+            single = len(info["key"]) == 1
+            existing[field] = existing.get(field, False) or (
+                single and info.get("unique", False)
+            )
+
+        for field, unique in INDEXES.items():
+            if field not in existing or (unique and not existing[field]):
+                missing.append((name, field, unique))
+    return missing
+
+
+def ensure_indexes(create=True):
+    """
+    Report the missing indexes and create them (safe to run repeatedly)
+
+    params:
+    create: bool - only report the missing indexes when False
+
+    returns: list of (collection name, field, unique) still missing
+    """
+    still_missing = []
+    for name, field, unique in missing_indexes():
+        kind = "unique index" if unique else "index"
+        if not create:
+            print(f"Missing {kind} on {name}.{field}")
+            still_missing.append((name, field, unique))
+            continue
+        try:
+            db[name].create_index(
+                [(field, ASCENDING)], unique=unique, name=f"migration_{field}"
+            )
+            print(f"Created {kind} on {name}.{field}")
+        except OperationFailure as e:
+            # e.g. duplicate ids or a non unique index on id already there
+            print(f"Could not create {kind} on {name}.{field}: {e}")
+            still_missing.append((name, field, unique))
+    return still_missing
@@ -0,0 +1,303 @@
+"""
+Module to spread an import over many processes and machines: the range is
+split into shard documents in the jobs collection, and workers claim them
+with leases they keep alive while importing. A shard whose lease expires
+(its worker died) is claimed again by another worker.
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, ReturnDocument
+from config import APP, DB
+from connections import db
+from checkpoints import Checkpoint
+from pipeline import get_page
+from sharding import plan_windows
+from writer import WriteResult
+import customers, orders, products
+
+IMPORTERS = {"orders": orders, "products": products, "customers": customers}
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+def create_job(job, resource, from_date, to_date, shard_size=APP.SHARD_SIZE):
+    """
+    Plan the shards of an import and add them to the jobs collection
+
+    Orders and products are split into date windows of about `shard_size`
+    records. Customers can not be filtered by date in the API, so their
+    listing is split into ranges of JOB_PAGES pages (oldest first, so
+    new registrations do not shift the pages of the shards).
+    All shards are written at once and a marker is saved after them.
+    Running it again for the same job and range adds nothing, another
+    range or shard size for an existing job is refused, and a job without
+    the marker (planning was interrupted) is planned again from scratch.
+
+    params:
+    job: str - name of the job
+    resource: str - "orders", "products" or "customers"
+    from_date: str - ISO datetime to import from
+    to_date: str - ISO datetime to import until
+    shard_size: int - records per date window
+
+    returns: number of shards in the job
+    """
+    jobs = db[DB.JOBS_COLLECTION]
+    jobs.create_index([("job", ASCENDING), ("status", ASCENDING)])
+    marker_id = f"job:{job}:{resource}"
+    plan = {"from_date": from_date, "to_date": to_date, "shard_size": shard_size}
+
+    # the shards are numbered, so a job must keep the plan it was made with
+    planned = db[DB.META_COLLECTION].find_one({"_id": marker_id})
+    if planned:
+        if {key: planned.get(key) for key in plan} != plan:
+            raise ValueError(
+                f"Job '{job}' already has {resource} shards from "
+                f"'{planned['from_date']}' to '{planned['to_date']}' (shard size "
+                f"{planned.get('shard_size')}), use the same range and shard size "
+                "to finish it or another job name"
+            )
+        return jobs.count_documents({"job": job, "resource": resource})
+
+    shards = []
+    if resource == "customers":
+        first_page = get_page(
+            "customers", customers.page_params(1, "asc", from_date, to_date)
+        )
+        total_pages = int(first_page.headers.get("X-WP-TotalPages", 0))
+        for start in range(1, total_pages + 1, APP.JOB_PAGES):
+            last = min(start + APP.JOB_PAGES - 1, total_pages)
+            shards.append({"first_page": start, "last_page": last})
+    else:
+        after = datetime.fromisoformat(from_date)
+        before = datetime.fromisoformat(to_date)
+        for start, end, total in plan_windows(resource, after, before, shard_size):
+            shards.append(
+                {"after": start.isoformat(), "before": end.isoformat(), "total": total}
+            )
+
+    created = datetime.utcnow()
+    for number, shard in enumerate(shards):
+        shard.update(
+            {
+                "_id": f"{job}:{resource}:{number:06d}",
+                "job": job,
+                "resource": resource,
+                **plan,
+                "status": PENDING,
+                "owner": None,
+                "lease_expires": None,
+                "attempts": 0,
+                "created": created,
+            }
+        )
+
+    # without the marker an earlier run stopped partway, so its shards are
+    # replaced by the whole plan, and the marker is only written after them
+    jobs.delete_many({"job": job, "resource": resource})
+    if shards:
+        jobs.insert_many(shards)
+    db[DB.META_COLLECTION].update_one(
+        {"_id": marker_id},
+        {"$set": {**plan, "shards": len(shards), "planned": datetime.utcnow()}},
+        upsert=True,
+    )
+    return len(shards)
+
+
+def job_status(job=None):
+    """
+    Number of shards in each status
+
+    returns: dict of status -> count
+    """
+    query = {"job": job} if job else {}
+    counts = {PENDING: 0, RUNNING: 0, DONE: 0, FAILED: 0}
+    for shard in db[DB.JOBS_COLLECTION].find(query, projection={"status": True}):
+        counts[shard["status"]] = counts.get(shard["status"], 0) + 1
+    return counts
+
+
+def claim_shard(worker, job=None, lease=APP.JOB_LEASE):
+    """
+    Take a pending shard, or a running one whose lease has expired, in one
+    atomic update so no two workers get the same shard
+
+    A shard whose lease expired on its last attempt (it keeps killing its
+    worker) is marked failed instead of being claimed again.
+
+    returns: the claimed shard or None
+    """
+    now = datetime.utcnow()
+    scope = {"job": job} if job else {}
+    expired = {"status": RUNNING, "lease_expires": {"$lt": now}}
+    db[DB.JOBS_COLLECTION].update_many(
+        {**scope, **expired, "attempts": {"$gte": APP.JOB_ATTEMPTS}},
+        {"$set": {"status": FAILED, "lease_expires": None, "finished": now}},
+    )
+
+    query = {
+        **scope,
+        "$or": [
+            {"status": PENDING},
+            {**expired, "attempts": {"$lt": APP.JOB_ATTEMPTS}},
+        ],
+    }
+    return db[DB.JOBS_COLLECTION].find_one_and_update(
+        query,
+        {
+            "$set": {
+                "status": RUNNING,
+                "owner": worker,
+                "lease_expires": now + timedelta(seconds=lease),
+                "claimed": now,
+            },
+            "$inc": {"attempts": 1},
+        },
+        sort=[("created", ASCENDING), ("_id", ASCENDING)],
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def renew_lease(shard_id, worker, lease=APP.JOB_LEASE):
+    """
+    Push the lease of a shard forward
+
+    returns: False if the shard is no longer held by the worker
+    """
+    result = db[DB.JOBS_COLLECTION].update_one(
+        {"_id": shard_id, "owner": worker, "status": RUNNING},
+        {"$set": {"lease_expires": datetime.utcnow() + timedelta(seconds=lease)}},
+    )
+    return result.matched_count == 1
+
+
+def finish_shard(shard, worker, summary):
+    """
+    Mark a shard done, or give it back (failed once out of attempts)
+
+    returns: the new status, or None if the worker no longer held the shard
+    """
+    if not summary.failed and not summary.failed_pages:
+        status = DONE
+    elif shard["attempts"] >= APP.JOB_ATTEMPTS:
+        status = FAILED
+    else:
+        status = PENDING
+    result = db[DB.JOBS_COLLECTION].update_one(
+        {"_id": shard["_id"], "owner": worker, "status": RUNNING},
+        {
+            "$set": {
+                "status": status,
+                "owner": None if status == PENDING else worker,
+                "lease_expires": None,
+                "finished": datetime.utcnow(),
+                "result": {
+                    "inserted": summary.inserted,
+                    "updated": summary.updated,
+                    "unchanged": summary.unchanged,
+                    "failed": summary.failed,
+                    "failed_pages": summary.failed_pages,
+                },
+            }
+        },
+    )
+    if result.matched_count == 0:
+        # the lease ran out and another worker owns the shard now
+        return None
+    return status
+
+
+def import_shard(shard, engine="threads"):
+    """
+    Fetch and write the pages of one shard, skipping pages a previous
+    holder of the shard already wrote
+
+    returns: WriteResult
+    """
+    resource = shard["resource"]
+    importer = IMPORTERS[resource]
+    checkpoint = Checkpoint(f"job:{shard['_id']}")
+
+    if resource == "customers":
+        from_date, to_date = shard["from_date"], shard["to_date"]
+        pages = range(shard["first_page"], shard["last_page"] + 1)
+        tasks = [customers.page_params(p, "asc", from_date, to_date) for p in pages]
+        return customers.import_pages(
+            tasks, len(tasks), from_date, to_date, engine, checkpoint=checkpoint
+        )
+
+    after = datetime.fromisoformat(shard["after"])
+    before = datetime.fromisoformat(shard["before"])
+    first_page = get_page(resource, importer.page_params(1, "asc", after, before))
+    total_pages = int(first_page.headers.get("X-WP-TotalPages", 0))
+    prefetched = []
+    if total_pages:
+        prefetched.append(
+            (importer.page_params(1, "asc", after, before), first_page.json())
+        )
+    pages = range(2, total_pages + 1)
+    tasks = (importer.page_params(page, "asc", after, before) for page in pages)
+    return importer.import_pages(
+        tasks, total_pages, engine, checkpoint=checkpoint, prefetched=prefetched
+    )
+
+
+def work(job=None, engine="threads", lease=APP.JOB_LEASE, wait=False):
+    """
+    Claim and import shards until none is left
+
+    params:
+    job: str - only work on this job (any job if not given)
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    lease: int - seconds a claimed shard stays ours without a heartbeat
+    wait: bool - keep polling for new shards instead of stopping
+    """
+    worker = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+    print(f"Worker {worker} started\n")
+
+    while True:
+        shard = claim_shard(worker, job, lease)
+        if not shard:
+            status = job_status(job)
+            # a running shard may still come back if its worker dies
+            if not wait and not status[RUNNING]:
+                print(f"No shards left: {status}")
+                return
+            time.sleep(APP.JOB_POLL_INTERVAL)
+            continue
+
+        print(f"Shard {shard['_id']} claimed (attempt {shard['attempts']})\n")
+        stop_heartbeat = threading.Event()
+
+        def heartbeat(shard_id=shard["_id"]):
+            while not stop_heartbeat.wait(lease / 3):
+                if not renew_lease(shard_id, worker, lease):
+                    print(f"Lost the lease of shard {shard_id}")
+                    return
+
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            summary = import_shard(shard, engine)
+        except Exception as e:
+            print(f"{e} while importing shard {shard['_id']}")
+            summary = WriteResult(failed_pages=1)
+        finally:
+            stop_heartbeat.set()
+
+        summary.print_summary()
+        status = finish_shard(shard, worker, summary)
+        if status is None:
+            # its checkpoint is in use by the new owner, leave it alone
+            print(f"Shard {shard['_id']} was taken over by another worker\n")
+            continue
+        if status == DONE:
+            Checkpoint(f"job:{shard['_id']}").clear()
+        print(f"Shard {shard['_id']} {status}\n")
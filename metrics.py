@@ -0,0 +1,219 @@
+"""
+Module to count and time what an import does (requests, bytes, decoding,
+transforming, writes, retries) and to expose it in the OpenMetrics text
+format, as a textfile or on a local /metrics endpoint
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import APP
+
+PREFIX = "woo_migration"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# name -> (type, help, buckets of histograms)
+METRICS = {
+    "http_request_seconds": ("histogram", "WooCommerce request time", LATENCY_BUCKETS),
+    "http_received_bytes": (
+        "counter",
+        "Bytes of WooCommerce response bodies as sent (decoded without Content-Length)",
+        None,
+    ),
+    "json_decode_seconds": ("histogram", "Time decoding a page", LATENCY_BUCKETS),
+    "transform_seconds": ("histogram", "Time processing a page", LATENCY_BUCKETS),
+    "mongo_write_seconds": ("histogram", "MongoDB bulk write time", LATENCY_BUCKETS),
+    "mongo_batch_size": ("histogram", "Records per MongoDB bulk write", SIZE_BUCKETS),
+    "page_retries": ("counter", "Page requests retried", None),
+    "failed_pages": ("counter", "Pages given up on", None),
+    "export_errors": ("counter", "Writes to export files that failed", None),
+    "records": ("counter", "Records handled, by result", None),
+    "cpu_seconds": ("counter", "CPU time of the threads in each timed stage", None),
+}
+
+# one dict of values per thread, so recording takes no lock
+_local = threading.local()
+_shards = []  # (thread, values)
+_shards_lock = threading.Lock()
+# values of threads that have finished
+_retired = {}
+started = time.time()
+
+
+def _shard():
+    try:
+        return _local.values
+    except AttributeError:
+        _local.values = {}
+        with _shards_lock:
+            _shards.append((threading.current_thread(), _local.values))
+        return _local.values
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    """Add to a counter."""
+    values = _shard()
+    key = _key(name, labels)
+    values[key] = values.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    """Record one value of a histogram."""
+    values = _shard()
+    key = _key(name, labels)
+    histogram = values.get(key)
+    if histogram is None:
+        buckets = METRICS[name][2]
+        # counts per bucket (the last one is +Inf), sum
+        histogram = values[key] = [[0] * (len(buckets) + 1), 0.0]
+    histogram[0][bisect_left(METRICS[name][2], value)] += 1
+    histogram[1] += value
+
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the seconds the block takes and count the CPU time it used."""
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+        inc("cpu_seconds", time.thread_time() - cpu_start, stage=name, **labels)
+
+
+def collect():
+    """
+    Sum the values of every thread
+
+    returns: dict of (name, labels) -> counter value or [bucket counts, sum]
+    """
+    with _shards_lock:
+        # fold finished threads in once, the pipelines start new ones
+        for thread, values in [s for s in _shards if not s[0].is_alive()]:
+            _merge(_retired, values)
+            _shards.remove((thread, values))
+        totals = _merge({}, _retired)
+        shards = [values for _, values in _shards]
+
+    for values in shards:
+        _merge(totals, values)
+    return totals
+
+
+def _merge(totals, values):
+    # a copy, the thread may add keys meanwhile
+    for key, value in dict(values).items():
+        if isinstance(value, list):
+            total = totals.setdefault(key, [[0] * len(value[0]), 0.0])
+            total[0] = [a + b for a, b in zip(total[0], value[0])]
+            total[1] += value[1]
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def _labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+def render():
+    """All metrics in the OpenMetrics text format."""
+    totals = collect()
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        full_name = f"{PREFIX}_{name}"
+        lines.append(f"# TYPE {full_name} {kind}")
+        lines.append(f"# HELP {full_name} {description}")
+        for (key_name, labels), value in sorted(totals.items(), key=str):
+            if key_name != name:
+                continue
+            if kind == "counter":
+                lines.append(f"{full_name}_total{_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ("+Inf",), value[0]):
+                cumulative += count
+                bucket_labels = _labels(labels, [("le", bound)])
+                lines.append(f"{full_name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{full_name}_count{_labels(labels)} {cumulative}")
+            lines.append(f"{full_name}_sum{_labels(labels)} {value[1]}")
+
+    written = sum(
+        value
+        for (name, labels), value in totals.items()
+        if name == "records" and dict(labels).get("result") in ("inserted", "updated")
+    )
+    elapsed = max(time.time() - started, 1e-9)
+    lines.append(f"# TYPE {PREFIX}_records_per_second gauge")
+    lines.append(f"# HELP {PREFIX}_records_per_second Records written per second")
+    lines.append(f"{PREFIX}_records_per_second {written / elapsed:.3f}")
+    lines.append("# EOF")
+    return "\n".join(lines) + "\n"
+
+
+def write_textfile(path):
+    """Write the metrics to a file (replaced whole, for textfile collectors)."""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write(render())
+    os.replace(temporary, path)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serve the metrics on GET /metrics."""
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header(
+            "Content-Type", "application/openmetrics-text; version=1.0.0; charset=utf-8"
+        )
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start(path=None, port=None, interval=APP.METRICS_INTERVAL):
+    """
+    Export the metrics while the process runs
+
+    params:
+    path: str - rewrite this textfile every `interval` seconds
+    port: int - serve /metrics on this local port
+    """
+    if port:
+        server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Metrics on http://127.0.0.1:{port}/metrics")
+
+    if path:
+
+        def write_periodically():
+            while True:
+                time.sleep(interval)
+                try:
+                    write_textfile(path)
+                except OSError as e:
+                    print(f"Could not write metrics to '{path}': {e}")
+
+        threading.Thread(target=write_periodically, daemon=True).start()
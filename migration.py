@@ -3,16 +3,72 @@ Command-line interface for the script
 """
 import click
 import datetime
-import customers, orders, products
+import importlib.util
+import metrics
+import profiles
+from config import APP
+
+# the importers are imported inside the commands, so --help and option
+# errors do not wait for the HTTP and MongoDB client libraries to load
+
+
+def check_engine(context, param, value):
+    """Stop before importing anything if the async engine can not run."""
+    if value == "async" and importlib.util.find_spec("aiohttp") is None:
+        raise click.BadParameter(
+            "the async engine requires aiohttp (pip install aiohttp)"
+        )
+    return value
+
+
+def start_import(payload, profile, cache_dir, export):
+    """
+    Set up an import command: payload profile, profiler, page cache,
+    export files and indexes
+
+    returns: False if the export files could not be opened
+    """
+    import indexes, page_cache, profiling, sinks
+
+    profiles.select(payload)
+    if profile:
+        profiling.start(profile)
+        click.get_current_context().call_on_close(profiling.stop)
+    page_cache.use(cache_dir)
+    try:
+        sinks.open_all(export)
+    except (OSError, RuntimeError, ValueError) as e:
+        print(e)
+        sinks.close_all()
+        return False
+    click.get_current_context().call_on_close(sinks.close_all)
+    indexes.ensure_indexes(create=APP.CREATE_INDEXES)
+    return True
 
 
 @click.group()
-def cli():
+@click.option(
+    "--metrics-file",
+    type=click.Path(dir_okay=False),
+    help="Write OpenMetrics of the run to this file (for a textfile collector)",
+    default=APP.METRICS_FILE,
+)
+@click.option(
+    "--metrics-port",
+    type=click.INT,
+    help="Serve OpenMetrics of the run on http://127.0.0.1:<port>/metrics",
+    default=APP.METRICS_PORT,
+)
+def cli(metrics_file, metrics_port):
     """
     A command-line tool to migrate orders and customers from WooCommerce
     to MongoDB database.
     """
-    pass
+    metrics.start(metrics_file, metrics_port)
+    if metrics_file:
+        # the final numbers once the command is done
+        context = click.get_current_context()
+        context.call_on_close(lambda: metrics.write_textfile(metrics_file))
 
 
 @click.command("orders")
@@ -50,15 +106,125 @@ def cli():
     help="Sync records (insert ones that are not in the Database)",
     default=False,
 )
-def import_orders(id, sort, after, before, days, hours, sync):
+@click.option(
+    "--engine",
+    "-e",
+    type=click.Choice(["threads", "async"]),
+    callback=check_engine,
+    help="Fetch pages on worker threads or on a single asyncio event loop",
+    default="threads",
+)
+@click.option(
+    "--retry-failed",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Fetch again the orders pages recorded in this dead-letter file",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Import orders modified since the last incremental import "
+    "(--after sets the GMT start of the first one)",
+    default=False,
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip pages written by an earlier interrupted import of the same "
+    "--after/--before range",
+    default=False,
+)
+@click.option(
+    "--shard-size",
+    type=click.INT,
+    help="Split the range into date windows of about this many orders, "
+    "fetched in parallel with shallow pages (0 = page through the whole range)",
+    default=APP.SHARD_SIZE,
+)
+@click.option(
+    "--payload",
+    type=click.Choice(list(profiles.PROFILES)),
+    help="Fields to request and store, slim leaves out meta_data, _links etc.",
+    default=APP.PAYLOAD_PROFILE,
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help="Save the raw fetched pages in this directory (read by --from-cache)",
+    default=APP.PAGE_CACHE_DIR,
+)
+@click.option(
+    "--from-cache",
+    is_flag=True,
+    help="Write the orders of the pages saved in --cache-dir again, without "
+    "requesting them from WooCommerce",
+    default=False,
+)
+@click.option(
+    "--export",
+    "-x",
+    multiple=True,
+    type=click.Path(dir_okay=False),
+    help="Also write the imported orders to this file: .parquet (needs pyarrow), "
+    ".ndjson, .ndjson.gz or .ndjson.zst (needs zstandard). Can be repeated",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(["stages", "sample", "cprofile"]),
+    is_flag=False,
+    flag_value="sample",
+    help='Print the wall and CPU time of each stage at the end; "sample" '
+    "(the default with no value) also writes sampled stacks to "
+    'profile.collapsed, "cprofile" also writes profile.pstats',
+)
+def import_orders(
+    id,
+    sort,
+    after,
+    before,
+    days,
+    hours,
+    sync,
+    engine,
+    retry_failed,
+    incremental,
+    resume,
+    shard_size,
+    payload,
+    cache_dir,
+    from_cache,
+    export,
+    profile,
+):
     """
     Import all orders created between a datetime range or specific order
     """
+    import orders
+
+    if not start_import(payload, profile, cache_dir, export):
+        return
+
+    if from_cache:
+        if not cache_dir:
+            print("Set the page cache directory with --cache-dir or PAGE_CACHE_DIR")
+            return
+        print(f"Importing orders pages saved in '{cache_dir}'...\n")
+        orders.import_cached_orders()
+        return
+
     if id:
         print(f"Importing specific order with ID {id}")
         orders.get_order(id)
         return
 
+    if retry_failed:
+        print(f"Importing orders pages recorded in '{retry_failed}'...\n")
+        orders.retry_failed_orders(retry_failed, engine)
+        return
+
+    if incremental:
+        orders.import_modified_orders(after, engine)
+        return
+
     if sort:
         if sort.startswith("asc"):
             sort = "asc"
@@ -69,8 +235,15 @@ def import_orders(id, sort, after, before, days, hours, sync):
         print(
             f"Importing all orders created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
-        orders.import_all_orders(sort, after, before)
+        orders.import_all_orders(
+            sort, after, before, engine=engine, resume=resume, shard_size=shard_size
+        )
     else:
+        if resume:
+            # ranges from --days/--hours end now, so they never match the
+            # checkpoint of an earlier run
+            print("--resume needs the same --after and --before as the run resumed")
+            return
         current_time = datetime.datetime.now()
         today = datetime.date.today()
         if days > 0:
@@ -97,9 +270,25 @@ def import_orders(id, sort, after, before, days, hours, sync):
             f"Importing all orders created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
         if sync:
-            orders.import_all_orders(sort, after, before, sync=True)
+            orders.import_all_orders(
+                sort,
+                after,
+                before,
+                sync=True,
+                engine=engine,
+                resume=resume,
+                shard_size=shard_size,
+            )
         else:
-            orders.import_all_orders(sort, after, before, sync=False)
+            orders.import_all_orders(
+                sort,
+                after,
+                before,
+                sync=False,
+                engine=engine,
+                resume=resume,
+                shard_size=shard_size,
+            )
 
 
 @click.command("customers")
@@ -137,15 +326,112 @@ def import_orders(id, sort, after, before, days, hours, sync):
     help="Sync records (insert ones that are not in the Database)",
     default=False,
 )
-def import_customers(id, sort, after, before, days, hours, sync):
+@click.option(
+    "--engine",
+    "-e",
+    type=click.Choice(["threads", "async"]),
+    callback=check_engine,
+    help="Fetch pages on worker threads or on a single asyncio event loop",
+    default="threads",
+)
+@click.option(
+    "--retry-failed",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Fetch again the customers pages recorded in this dead-letter file",
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip pages written by an earlier interrupted import of the same "
+    "--after/--before range",
+    default=False,
+)
+@click.option(
+    "--payload",
+    type=click.Choice(list(profiles.PROFILES)),
+    help="Fields to request and store, slim leaves out meta_data, _links etc.",
+    default=APP.PAYLOAD_PROFILE,
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help="Save the raw fetched pages in this directory (read by --from-cache)",
+    default=APP.PAGE_CACHE_DIR,
+)
+@click.option(
+    "--from-cache",
+    is_flag=True,
+    help="Write the customers of the pages saved in --cache-dir again, without "
+    "requesting them from WooCommerce",
+    default=False,
+)
+@click.option(
+    "--export",
+    "-x",
+    multiple=True,
+    type=click.Path(dir_okay=False),
+    help="Also write the imported customers to this file: .parquet (needs pyarrow), "
+    ".ndjson, .ndjson.gz or .ndjson.zst (needs zstandard). Can be repeated",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(["stages", "sample", "cprofile"]),
+    is_flag=False,
+    flag_value="sample",
+    help='Print the wall and CPU time of each stage at the end; "sample" '
+    "(the default with no value) also writes sampled stacks to "
+    'profile.collapsed, "cprofile" also writes profile.pstats',
+)
+def import_customers(
+    id,
+    sort,
+    after,
+    before,
+    days,
+    hours,
+    sync,
+    engine,
+    retry_failed,
+    resume,
+    payload,
+    cache_dir,
+    from_cache,
+    export,
+    profile,
+):
     """
     Import all customers created between a datetime range or specific customer
     """
+    if engine == "async" and not retry_failed:
+        # the scan decides from each page whether to fetch the next ones
+        raise click.BadParameter(
+            "the customers scan runs on threads, async only works with "
+            "--retry-failed",
+            param_hint="'--engine'",
+        )
+    import customers
+
+    if not start_import(payload, profile, cache_dir, export):
+        return
+
+    if from_cache:
+        if not cache_dir:
+            print("Set the page cache directory with --cache-dir or PAGE_CACHE_DIR")
+            return
+        print(f"Importing customers pages saved in '{cache_dir}'...\n")
+        customers.import_cached_customers()
+        return
+
     if id:
         print(f"Importing specific customer with ID {id}...\n")
         customers.get_customer(id)
         return
 
+    if retry_failed:
+        print(f"Importing customers pages recorded in '{retry_failed}'...\n")
+        customers.retry_failed_customers(retry_failed, engine)
+        return
+
     if sort:
         if sort.startswith("asc"):
             sort = "asc"
@@ -156,8 +442,13 @@ def import_customers(id, sort, after, before, days, hours, sync):
         print(
             f"Importing all customers created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
-        customers.import_all_customers(sort, after, before)
+        customers.import_all_customers(sort, after, before, resume=resume)
     else:
+        if resume:
+            # ranges from --days/--hours end now, so they never match the
+            # checkpoint of an earlier run
+            print("--resume needs the same --after and --before as the run resumed")
+            return
         current_time = datetime.datetime.now()
         today = datetime.date.today()
         if days > 0:
@@ -184,9 +475,13 @@ def import_customers(id, sort, after, before, days, hours, sync):
             f"Importing all customers created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
         if sync == True:
-            customers.import_all_customers(sort, after, before, sync=True)
+            customers.import_all_customers(
+                sort, after, before, sync=True, resume=resume
+            )
         else:
-            customers.import_all_customers(sort, after, before, sync=False)
+            customers.import_all_customers(
+                sort, after, before, sync=False, resume=resume
+            )
 
 
 @click.command("products")
@@ -224,15 +519,125 @@ def import_customers(id, sort, after, before, days, hours, sync):
     help="Sync records (insert ones that are not in the Database)",
     default=False,
 )
-def import_products(id, sort, after, before, days, hours, sync):
+@click.option(
+    "--engine",
+    "-e",
+    type=click.Choice(["threads", "async"]),
+    callback=check_engine,
+    help="Fetch pages on worker threads or on a single asyncio event loop",
+    default="threads",
+)
+@click.option(
+    "--retry-failed",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Fetch again the products pages recorded in this dead-letter file",
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    help="Import products modified since the last incremental import "
+    "(--after sets the GMT start of the first one)",
+    default=False,
+)
+@click.option(
+    "--resume",
+    is_flag=True,
+    help="Skip pages written by an earlier interrupted import of the same "
+    "--after/--before range",
+    default=False,
+)
+@click.option(
+    "--shard-size",
+    type=click.INT,
+    help="Split the range into date windows of about this many products, "
+    "fetched in parallel with shallow pages (0 = page through the whole range)",
+    default=APP.SHARD_SIZE,
+)
+@click.option(
+    "--payload",
+    type=click.Choice(list(profiles.PROFILES)),
+    help="Fields to request and store, slim leaves out meta_data, _links etc.",
+    default=APP.PAYLOAD_PROFILE,
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False),
+    help="Save the raw fetched pages in this directory (read by --from-cache)",
+    default=APP.PAGE_CACHE_DIR,
+)
+@click.option(
+    "--from-cache",
+    is_flag=True,
+    help="Write the products of the pages saved in --cache-dir again, without "
+    "requesting them from WooCommerce",
+    default=False,
+)
+@click.option(
+    "--export",
+    "-x",
+    multiple=True,
+    type=click.Path(dir_okay=False),
+    help="Also write the imported products to this file: .parquet (needs pyarrow), "
+    ".ndjson, .ndjson.gz or .ndjson.zst (needs zstandard). Can be repeated",
+)
+@click.option(
+    "--profile",
+    type=click.Choice(["stages", "sample", "cprofile"]),
+    is_flag=False,
+    flag_value="sample",
+    help='Print the wall and CPU time of each stage at the end; "sample" '
+    "(the default with no value) also writes sampled stacks to "
+    'profile.collapsed, "cprofile" also writes profile.pstats',
+)
+def import_products(
+    id,
+    sort,
+    after,
+    before,
+    days,
+    hours,
+    sync,
+    engine,
+    retry_failed,
+    incremental,
+    resume,
+    shard_size,
+    payload,
+    cache_dir,
+    from_cache,
+    export,
+    profile,
+):
     """
     Import all products created between a datetime range or specific product
     """
+    import products
+
+    if not start_import(payload, profile, cache_dir, export):
+        return
+
+    if from_cache:
+        if not cache_dir:
+            print("Set the page cache directory with --cache-dir or PAGE_CACHE_DIR")
+            return
+        print(f"Importing products pages saved in '{cache_dir}'...\n")
+        products.import_cached_products()
+        return
+
     if id:
         print(f"Importing specific product with ID {id}")
         products.get_product(id)
         return
 
+    if retry_failed:
+        print(f"Importing products pages recorded in '{retry_failed}'...\n")
+        products.retry_failed_products(retry_failed, engine)
+        return
+
+    if incremental:
+        products.import_modified_products(after, engine)
+        return
+
     if sort:
         if sort.startswith("asc"):
             sort = "asc"
@@ -243,8 +648,15 @@ def import_products(id, sort, after, before, days, hours, sync):
         print(
             f"Importing all products created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
-        products.import_all_products(sort, after, before)
+        products.import_all_products(
+            sort, after, before, engine=engine, resume=resume, shard_size=shard_size
+        )
     else:
+        if resume:
+            # ranges from --days/--hours end now, so they never match the
+            # checkpoint of an earlier run
+            print("--resume needs the same --after and --before as the run resumed")
+            return
         current_time = datetime.datetime.now()
         today = datetime.date.today()
         if days > 0:
@@ -271,14 +683,242 @@ def import_products(id, sort, after, before, days, hours, sync):
             f"Importing all products created after '{after}' and before '{before}' sorted '{sort}'...\n"
         )
         if sync:
-            products.import_all_products(sort, after, before, sync=True)
+            products.import_all_products(
+                sort,
+                after,
+                before,
+                sync=True,
+                engine=engine,
+                resume=resume,
+                shard_size=shard_size,
+            )
         else:
-            products.import_all_products(sort, after, before, sync=False)
+            products.import_all_products(
+                sort,
+                after,
+                before,
+                sync=False,
+                engine=engine,
+                resume=resume,
+                shard_size=shard_size,
+            )
+
+
+@click.command("watch")
+@click.option(
+    "--orders-interval",
+    type=click.INT,
+    help="Seconds between polls for modified orders (0 to turn off)",
+    default=APP.WATCH_ORDERS_INTERVAL,
+)
+@click.option(
+    "--products-interval",
+    type=click.INT,
+    help="Seconds between polls for modified products (0 to turn off)",
+    default=APP.WATCH_PRODUCTS_INTERVAL,
+)
+@click.option(
+    "--customers-interval",
+    type=click.INT,
+    help="Seconds between polls for new customers (0 to turn off)",
+    default=APP.WATCH_CUSTOMERS_INTERVAL,
+)
+@click.option(
+    "--after",
+    "-a",
+    help="GMT datetime to start from for resources never imported incrementally "
+    "(default=now)",
+)
+@click.option(
+    "--engine",
+    "-e",
+    type=click.Choice(["threads", "async"]),
+    callback=check_engine,
+    help="Fetch pages on worker threads or on a single asyncio event loop",
+    default="threads",
+)
+@click.option(
+    "--payload",
+    type=click.Choice(list(profiles.PROFILES)),
+    help="Fields to request and store, slim leaves out meta_data, _links etc.",
+    default=APP.PAYLOAD_PROFILE,
+)
+def watch(
+    orders_interval, products_interval, customers_interval, after, engine, payload
+):
+    """
+    Keep polling WooCommerce and upsert changed records until stopped
+    """
+    import indexes, watcher
+
+    profiles.select(payload)
+    indexes.ensure_indexes(create=APP.CREATE_INDEXES)
+
+    intervals = {
+        "orders": orders_interval,
+        "products": products_interval,
+        "customers": customers_interval,
+    }
+    watcher.watch(intervals, after, engine)
+
+
+@click.command("webhooks")
+@click.option("--host", help="Address to listen on", default="0.0.0.0")
+@click.option("--port", "-p", type=click.INT, help="Port to listen on", default=8000)
+@click.option(
+    "--reconcile-interval",
+    type=click.INT,
+    help="Seconds between polls for modified orders and products that catch "
+    "missed deliveries (0 to turn off)",
+    default=APP.WEBHOOK_RECONCILE_INTERVAL,
+)
+@click.option(
+    "--payload",
+    type=click.Choice(list(profiles.PROFILES)),
+    help="Fields to request and store, slim leaves out meta_data, _links etc.",
+    default=APP.PAYLOAD_PROFILE,
+)
+def receive_webhooks(host, port, reconcile_interval, payload):
+    """
+    Receive WooCommerce webhooks and upsert the pushed records
+    """
+    import indexes, webhooks
+
+    profiles.select(payload)
+    indexes.ensure_indexes(create=APP.CREATE_INDEXES)
+
+    webhooks.serve(host, port, reconcile_interval)
+
+
+@click.command("init-db")
+@click.option(
+    "--check",
+    is_flag=True,
+    help="Only report the missing indexes, do not create them",
+    default=False,
+)
+def init_db(check):
+    """
+    Create the indexes of the orders, products and customers collections
+    """
+    import indexes
+
+    missing = indexes.ensure_indexes(create=not check)
+    if missing:
+        print(f"{len(missing)} indexes missing")
+    else:
+        print("All indexes are in place")
+
+
+@click.command("coordinate")
+@click.argument("resource", type=click.Choice(["orders", "products", "customers"]))
+@click.option("--job", "-j", help="Name of the job", default="import")
+@click.option("--after", "-a", help="ISO datetime to import records after (FROM)")
+@click.option("--before", "-b", help="ISO datetime to import records before (TO)")
+@click.option(
+    "--days",
+    "-d",
+    type=click.INT,
+    help="Import records created in the past X days",
+    default=0,
+)
+@click.option(
+    "--shard-size",
+    type=click.IntRange(min=1),
+    help="Orders or products per shard (date window)",
+    default=APP.SHARD_SIZE or 5000,
+)
+@click.option(
+    "--status",
+    is_flag=True,
+    help="Only show how many shards of the job are pending, running, done or failed",
+    default=False,
+)
+def coordinate(resource, job, after, before, days, shard_size, status):
+    """
+    Split an import into shards for `worker` processes to claim
+    """
+    import indexes, jobs
+
+    if status:
+        print(jobs.job_status(job))
+        return
+
+    if not after and not days:
+        print("Set the start of the range with --after or --days")
+        return
+
+    indexes.ensure_indexes(create=APP.CREATE_INDEXES)
+    if not before:
+        before = datetime.datetime.now().isoformat(timespec="seconds")
+    if not after:
+        after = (
+            datetime.datetime.fromisoformat(before) - datetime.timedelta(days=days)
+        ).isoformat()
+
+    print(
+        f"Planning {resource} shards of job '{job}' from '{after}' to '{before}'...\n"
+    )
+    try:
+        shards = jobs.create_job(job, resource, after, before, shard_size)
+    except Exception as e:
+        print(f"{e} while planning the shards")
+        return
+    print(f"Shards in the job: {shards}")
+
+
+@click.command("worker")
+@click.option("--job", "-j", help="Only claim shards of this job (any job if not set)")
+@click.option(
+    "--engine",
+    "-e",
+    type=click.Choice(["threads", "async"]),
+    callback=check_engine,
+    help="Fetch pages on worker threads or on a single asyncio event loop",
+    default="threads",
+)
+@click.option(
+    "--lease",
+    type=click.IntRange(min=3),
+    help="Seconds a shard stays claimed without a heartbeat from this worker",
+    default=APP.JOB_LEASE,
+)
+@click.option(
+    "--wait",
+    is_flag=True,
+    help="Keep waiting for new shards instead of stopping when none is left",
+    default=False,
+)
+@click.option(
+    "--payload",
+    type=click.Choice(list(profiles.PROFILES)),
+    help="Fields to request and store, slim leaves out meta_data, _links etc.",
+    default=APP.PAYLOAD_PROFILE,
+)
+def worker(job, engine, lease, wait, payload):
+    """
+    Claim shards planned by `coordinate` and import them until none is left
+    """
+    import indexes, jobs
+
+    profiles.select(payload)
+    indexes.ensure_indexes(create=APP.CREATE_INDEXES)
+
+    try:
+        jobs.work(job, engine, lease, wait)
+    except KeyboardInterrupt:
+        # the lease of the current shard runs out and another worker takes it
+        print("Worker stopped")
 
 
 cli.add_command(import_orders)
 cli.add_command(import_products)
 cli.add_command(import_customers)
+cli.add_command(watch)
+cli.add_command(receive_webhooks)
+cli.add_command(init_db)
+cli.add_command(coordinate)
+cli.add_command(worker)
 
 
 if __name__ == "__main__":
@@ -1,35 +1,46 @@
 """
 Moudle to import all orders or specific order from WooCommerce
 """
-import concurrent.futures
+from math import ceil
 from datetime import datetime
-from tqdm import tqdm
 from dateutil import parser as dateparser
-from config import DB, APP
+from config import APP, DB
 from connections import wcapi, db
+from checkpoints import Checkpoint
+from pipeline import get_page
+from sharding import plan_windows
+from writer import bulk_upsert
+from dates import ORDER_DATES
+from id_index import IdIndex, find_ids
+import importing
+import profiles
 
-MAX_THREADS = APP.MAX_THREADS
 max_order_per_page = 100
 
-# list of orders ids that are in the database currently
-orders_in_db = set()
-
-num_of_written_records = 0
-num_of_skipped_records = 0
+# ids of the orders in the range that are in the database (sync mode)
+orders_in_db = IdIndex()
 
 
 def get_orders_in_db(from_date, to_date):
-    """Get all orders in the range given that are in the database."""
+    """Get the ids of all orders in the range given that are in the database."""
     # Mongo friendly datetime
     from_date = dateparser.isoparse(from_date)
     to_date = dateparser.isoparse(to_date)
-    results = db[DB.ORDER_COLLECTION].find(
+    return find_ids(
+        db[DB.ORDER_COLLECTION],
         {"date_created": {"$gte": from_date, "$lte": to_date}},
     )
-    return results
 
 
-def import_all_orders(sort, from_date, to_date, sync=False):
+def import_all_orders(
+    sort,
+    from_date,
+    to_date,
+    sync=False,
+    engine="threads",
+    resume=False,
+    shard_size=APP.SHARD_SIZE,
+):
     """
     Import all orders between from_date and to_date
 
@@ -37,150 +48,205 @@ def import_all_orders(sort, from_date, to_date, sync=False):
     sort: str - Sort orders ascending or descending.
     from_date: str - import orders submitted starting from this date
     to_date: str - import orders submitted untill this date
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    resume: bool - skip pages written by an earlier run of the same range
+    shard_size: int - split the range into date windows of about this many
+    orders instead of paginating through the whole range (0 to turn off)
 
     returns: list of orders
     """
-    global num_of_skipped_records, num_of_written_records
-
     if sync == True:
-        # get all orders that are in the database first
-        results = get_orders_in_db(from_date, to_date)
-        for order in results:
-            orders_in_db.add(order.get("id"))
+        # get the ids of all orders that are in the database first
+        orders_in_db.load(get_orders_in_db(from_date, to_date))
+    else:
+        orders_in_db.clear()
 
     print("Orders found in DB: ", len(orders_in_db))
 
     after = datetime.fromisoformat(from_date)
     before = datetime.fromisoformat(to_date)
+    prefetched = []
+
+    if shard_size:
+        # shallow pages of stable windows instead of deep offsets, which
+        # get slower the deeper they go and shift as orders are added
+        try:
+            windows = plan_windows("orders", after, before, shard_size)
+        except Exception as e:
+            print(f"{e} while planning date windows, nothing imported")
+            return
+
+        if sort == "desc":
+            windows.reverse()
+        tasks = [
+            page_params(page, sort, start, end)
+            for start, end, total in windows
+            for page in range(1, ceil(total / max_order_per_page) + 1)
+        ]
+        total_pages = len(tasks)
+        print(f"Date windows: {len(windows)}, total pages: {total_pages}\n")
+    else:
+        try:
+            initial_orders = get_page("orders", page_params(1, sort, after, before))
+        except Exception as e:
+            print(f"{e} for the first page, nothing imported")
+            return
+
+        total_pages = int(initial_orders.headers.get("X-WP-TotalPages", 0))
+        print(f"Total pages: {total_pages}\n")
+        # the first page is processed as it is, the rest fetched meanwhile
+        if total_pages:
+            first_page = (page_params(1, sort, after, before), initial_orders.json())
+            prefetched.append(first_page)
+        pages = range(2, total_pages + 1)
+        tasks = (page_params(page, sort, after, before) for page in pages)
+
+    checkpoint = Checkpoint(f"orders:{from_date}:{to_date}:{sort}")
+    if resume:
+        print(f"Pages already imported: {len(checkpoint.done)}\n")
+    else:
+        checkpoint.clear()
+
+    summary = import_pages(
+        tasks, total_pages, engine, checkpoint=checkpoint, prefetched=prefetched
+    )
+    summary.print_summary()
 
-    page = 1
-    initial_orders = wcapi.get(
+    if not summary.failed and not summary.failed_pages:
+        # the whole range is imported, nothing is left to resume
+        checkpoint.clear()
+
+
+def retry_failed_orders(path, engine="threads"):
+    """
+    Fetch again the pages of orders recorded in a dead-letter file
+
+    params:
+    path: str - dead-letter file written by a previous import
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    importing.retry_failed(
+        "orders", process_orders, DB.ORDER_COLLECTION, path, engine
+    )
+
+
+def import_cached_orders():
+    """Transform and write again the pages of orders saved in the page cache."""
+    orders_in_db.clear()
+    importing.import_cached("orders", process_orders, DB.ORDER_COLLECTION)
+
+
+def import_modified_orders(from_date=None, engine="threads"):
+    """
+    Import orders modified since the newest one imported by the previous
+    incremental import, and move the watermark forward
+
+    params:
+    from_date: str - GMT datetime to start from when there is no watermark yet
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    importing.import_modified(
+        "orders",
+        process_orders,
+        DB.ORDER_COLLECTION,
+        modified_page_params,
+        max_order_per_page,
+        from_date,
+        engine,
+    )
+
+
+def import_pages(
+    tasks,
+    total,
+    engine="threads",
+    dead_letter=APP.DEAD_LETTER_FILE,
+    checkpoint=None,
+    prefetched=(),
+):
+    """
+    Fetch, process and write the pages of orders given by their query params,
+    and the (params, records) of pages already fetched
+    """
+    return importing.import_pages(
         "orders",
-        params={
-            "per_page": max_order_per_page,
-            "after": after.isoformat(),
-            "before": before.isoformat(),
-            "page": page,
-            "order": sort,
-        },
+        process_orders,
+        DB.ORDER_COLLECTION,
+        tasks,
+        total,
+        engine,
+        dead_letter=dead_letter,
+        checkpoint=checkpoint,
+        prefetched=prefetched,
     )
-    total_pages = initial_orders.headers.get("X-WP-TotalPages", 0)
-    print(f"Total pages: {total_pages}\n")
-    pages = range(1, int(total_pages) + 1)
-
-    # use multi-threading to pull multiple orders concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        future_to_order = {
-            executor.submit(get_orders, page, sort, after, before): page
-            for page in pages
-        }
-        for future in tqdm(
-            concurrent.futures.as_completed(future_to_order),
-            total=int(total_pages),
-            unit="page",
-        ):
-            try:
-                status = future.result()
-            except:
-                pass
-
-    print(f'\n\n{"-" * 50}')
-    print(f"Newly inserted records: {num_of_written_records}")
-    print(f"Skipped records: {num_of_skipped_records}\n")
-
-
-def get_orders(page, sort, after, before):
-    """Get orders on a specific page."""
-    try:
-        response = wcapi.get(
-            "orders",
-            params={
-                "per_page": max_order_per_page,
-                "after": after.isoformat(),
-                "before": before.isoformat(),
-                "page": page,
-                "order": sort,
-            },
-        )
-        if response.status_code != 200:
-            print(f"Error status code {response.status_code} for page {page}")
-        else:
-            orders = tuple(response.json())
-            for order in orders:
-                process_order(order)
-
-            orders = None  # clear previous values to free up memeory
-            return True
-    except Exception as e:
-        print(f"Unexpected Error: {e}")
-    return False
+
+
+def page_params(page, sort, after, before):
+    """Query parameters to request a specific page of orders."""
+    return {
+        "per_page": max_order_per_page,
+        "after": after.isoformat(),
+        "before": before.isoformat(),
+        "page": page,
+        "order": sort,
+    }
+
+
+def modified_page_params(page, modified_after):
+    """Query parameters to request a page of orders modified after a GMT date."""
+    return {
+        "per_page": max_order_per_page,
+        "modified_after": modified_after,
+        "dates_are_gmt": "true",
+        "orderby": "modified",
+        "order": "asc",
+        "page": page,
+    }
+
+
+def process_orders(records):
+    """
+    Process a page of orders and leave out the ones already in the database
+
+    returns: tuple of processed orders and number of skipped orders
+    """
+    orders = []
+    skipped = 0
+    for order in records:
+        order = process_order(order)
+        if not order:
+            continue
+        if order["id"] in orders_in_db:
+            # print(f"Order id: {order['id']} found in DB (skipping)")
+            skipped += 1
+            continue
+        orders.append(order)
+
+    return orders, skipped
 
 
 def process_order(order):
     """
     Process order to convert date and times to datetime objects
-    and insert to MongoDB database
-    """
-    global num_of_skipped_records, num_of_written_records
 
+    returns: processed order or None if it has no id
+    """
     if not order.get("id", None):
         print("No order id skipping")
-        return
+        return None
 
-    date_fields = [
-        "date_created",
-        "date_created_gmt",
-        "date_modified",
-        "date_modified_gmt",
-        "date_paid",
-        "date_paid_gmt",
-        "date_completed",
-        "date_completed_gmt",
-    ]
-    for field in date_fields:
-        if field not in order:
-            continue
-        str_date = order[field]
-        if not str_date:
-            continue
-        order[field] = dateparser.isoparse(str_date)
-
-    order_id = order.get("id")
-    if order_id not in orders_in_db:
-        db[DB.ORDER_COLLECTION].find_one_and_replace(
-            filter={"id": order_id}, replacement=order, upsert=True
-        )
-        num_of_written_records += 1
-    else:
-        # print(f"Order id: {order_id} found in DB (skipping)")
-        num_of_skipped_records += 1
+    order = profiles.trim("orders", order)
+
+    order = ORDER_DATES(order)
+
+    return order
 
 
 def get_order(id):
     """Get specific order specified by ID."""
-    order = wcapi.get(f"orders/{id}").json()
-    if not order.get("id", None):
-        print("No order id skipping")
+    params = profiles.with_fields("orders", {})
+    order = process_order(wcapi.get(f"orders/{id}", params=params).json())
+    if not order:
         return
 
-    date_fields = [
-        "date_created",
-        "date_created_gmt",
-        "date_modified",
-        "date_modified_gmt",
-        "date_paid",
-        "date_paid_gmt",
-        "date_completed",
-        "date_completed_gmt",
-    ]
-    for field in date_fields:
-        if field not in order:
-            continue
-        str_date = order[field]
-        if not str_date:
-            continue
-        order[field] = dateparser.isoparse(str_date)
-
-    db[DB.ORDER_COLLECTION].find_one_and_replace(
-        filter={"id": order.get("id")}, replacement=order, upsert=True
-    )
+    bulk_upsert(db[DB.ORDER_COLLECTION], [order])
@@ -0,0 +1,139 @@
+"""
+Module to keep the raw pages fetched from WooCommerce as gzipped NDJSON
+files, so the records can be transformed and written again without
+requesting them from the store
+"""
+import glob
+import gzip
+import json
+import os
+import re
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from tqdm import tqdm
+from config import APP
+from writer import WriteResult
+import profiles
+
+# directory pages are saved to, None to not save them
+directory = APP.PAGE_CACHE_DIR
+
+
+def use(path):
+    """Save fetched pages under this directory (None to stop saving)."""
+    global directory
+    directory = path
+
+
+def page_path(resource, params, root=None):
+    """
+    File of a page: <root>/<resource>/<window>/page-<n>.ndjson.gz, where the
+    window is made of the query parameters other than the page
+    """
+    window = "_".join(
+        f"{key}={params[key]}"
+        for key in sorted(params)
+        if key not in ("page", "per_page", "_fields")
+    )
+    window = re.sub(r"[^\w.=+-]+", "-", window) or "all"
+    page = int(params.get("page", 1))
+    return os.path.join(
+        root or directory, resource, window, f"page-{page:06d}.ndjson.gz"
+    )
+
+
+def save(resource, params, records):
+    """Save the records of a page, one JSON object per line."""
+    if not directory:
+        return
+    path = page_path(resource, params)
+    # written aside first so a replay never reads half a page
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with gzip.open(temporary, "wt", encoding="utf-8", compresslevel=5) as f:
+            for record in records:
+                f.write(json.dumps(record, separators=(",", ":")) + "\n")
+        os.replace(temporary, path)
+    except OSError as e:
+        # the import goes on without the cache
+        print(f"Could not cache page {params.get('page')} of {resource}: {e}")
+
+
+def cached_pages(resource, root=None):
+    """Paths of all pages of a resource in the cache."""
+    pattern = os.path.join(root or directory, resource, "*", "page-*.ndjson.gz")
+    return sorted(glob.glob(pattern))
+
+
+def load_page(path, transform=None):
+    """
+    Read the records of a cached page and optionally transform them
+
+    returns: list of records, or what transform returns for them
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return transform(records) if transform else records
+
+
+def replay(resource, transform, write, processes=APP.CACHE_PROCESSES):
+    """
+    Transform and write every cached page of a resource, with no requests
+
+    Pages are decoded and transformed in a pool of processes, one per CPU
+    core by default, while this process writes the results.
+
+    params:
+    resource: str - WooCommerce endpoint, e.g. "orders"
+    transform: callable(records) - module level function (it is pickled)
+    returning (processed records, skipped count)
+    write: callable(records) - writes records and returns a WriteResult
+    processes: int - decoding processes (0 for one per CPU core)
+
+    returns: WriteResult
+    """
+    paths = cached_pages(resource)
+    print(f"Cached pages found: {len(paths)}\n")
+
+    workers = processes or os.cpu_count() or 1
+    summary = WriteResult()
+    # the workers are spawned rather than forked on some platforms, so
+    # they are told the payload profile instead of inheriting it
+    pool = ProcessPoolExecutor(
+        workers, initializer=profiles.select, initargs=(profiles.selected,)
+    )
+    with pool, tqdm(total=len(paths), unit="page") as progress:
+        # only a few pages per process in flight, so decoded pages do not
+        # pile up here when the writes are slower than the decoding
+        in_flight = deque()
+        paths = iter(paths)
+        for path in islice(paths, workers * 2):
+            in_flight.append((path, pool.submit(load_page, path, transform)))
+        while in_flight:
+            path, future = in_flight.popleft()
+            next_path = next(paths, None)
+            if next_path:
+                in_flight.append(
+                    (next_path, pool.submit(load_page, next_path, transform))
+                )
+            summary += _write_page(path, future, write)
+            progress.update()
+    return summary
+
+
+def _write_page(path, future, write):
+    try:
+        records, skipped = future.result()
+    except Exception as e:
+        print(f"{e} while processing cached page '{path}'")
+        return WriteResult(failed_pages=1)
+    try:
+        result = write(records)
+    except Exception as e:
+        print(f"Unexpected Error: {e}")
+        result = WriteResult(failed=len(records))
+    result.skipped += skipped
+    return result
@@ -0,0 +1,369 @@
+"""
+Module to run an import as a staged pipeline: fetch pages from WooCommerce,
+transform records and write them to MongoDB, each stage on its own threads
+connected by bounded queues.
+"""
+import queue
+import random
+import threading
+import time
+from datetime import datetime, timedelta
+from tqdm import tqdm
+from config import APP
+from connections import wcapi
+from failed_pages import record_failed_page
+from writer import WriteResult
+import metrics
+import page_cache
+import profiles
+import throttle
+
+# marks the end of the work for one worker of the next stage
+_DONE = object()
+
+
+class PageError(Exception):
+    """A page request that did not return the records."""
+
+
+def fetch_page(endpoint, params):
+    """Get one page of records, raising PageError for a non-200 response."""
+    response = wcapi.get(endpoint, params=profiles.with_fields(endpoint, params))
+    if response.status_code != 200:
+        raise PageError(f"Error status code {response.status_code}")
+    with metrics.timer("json_decode_seconds", resource=endpoint):
+        return response.json()
+
+
+def backoff_delay(attempt):
+    """Seconds to wait before the next attempt (exponential with full jitter)."""
+    return random.uniform(
+        0, min(APP.RETRY_BACKOFF * 2**attempt, APP.RETRY_BACKOFF_MAX)
+    )
+
+
+def get_page(endpoint, params, max_attempts=APP.PAGE_ATTEMPTS):
+    """
+    Request one page, retrying with backoff until it returns 200
+
+    returns: response of the page
+    """
+    params = profiles.with_fields(endpoint, params)
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = wcapi.get(endpoint, params=params)
+            if response.status_code == 200:
+                return response
+            error = PageError(f"Error status code {response.status_code}")
+        except Exception as e:
+            error = e
+        if attempt < max_attempts:
+            metrics.inc("page_retries", resource=endpoint)
+            time.sleep(backoff_delay(attempt))
+    raise error
+
+
+class KeysetPages:
+    """
+    Pages of records modified after a GMT date, oldest first, each requested
+    from the date of the last record of the page before it
+
+    With offset pages a record modified during the import moves to the end
+    and shifts the next record onto a page already fetched, where it is
+    never seen. Starting every page from the last date fetched keeps the
+    records still to come on the pages still to come. Iterating yields the
+    (params, records) of each page until a page comes back short.
+
+    params:
+    endpoint: str - WooCommerce endpoint, e.g. "orders"
+    page_params: callable(page, modified_after) - query parameters of a page
+    modified_after: datetime - GMT date to start after
+    per_page: int - number of records on a full page
+    """
+
+    def __init__(self, endpoint, page_params, modified_after, per_page):
+        self.endpoint = endpoint
+        self.page_params = page_params
+        self.modified_after = modified_after
+        self.per_page = per_page
+        # set when a page could not be fetched and the rest was left out
+        self.failed = False
+
+    def __iter__(self):
+        after = self.modified_after
+        page = 1
+        while True:
+            params = self.page_params(page, after.isoformat())
+            try:
+                records = get_page(self.endpoint, params).json()
+            except Exception as e:
+                print(f"{e} for the page after '{after.isoformat()}', stopping")
+                self.failed = True
+                return
+            if records:
+                yield params, records
+            if len(records) < self.per_page:
+                return
+
+            # modified_after is exclusive and has whole seconds, so go back a
+            # second not to miss the rest of the last record's second
+            last = records[-1].get("date_modified_gmt")
+            last = last and datetime.fromisoformat(last) - timedelta(seconds=1)
+            if last and last > after:
+                after, page = last, 1
+            else:
+                # a full page modified within the same seconds, step past it
+                page += 1
+
+
+class Pipeline:
+    """
+    Fetch -> transform -> write pipeline
+
+    Tasks are the query parameters of the pages to fetch. A page that fails
+    is retried with jittered exponential backoff and written to the
+    dead-letter file once it has failed `max_attempts` times.
+
+    params:
+    endpoint: str - WooCommerce endpoint, e.g. "orders"
+    transform: callable(records) - returns (processed records, skipped count)
+    write: callable(records) - writes records and returns a WriteResult
+    context: dict - saved with failed pages, needed to process them again
+    checkpoint: Checkpoint - pages already done are skipped and written
+    pages are recorded in it
+    """
+
+    def __init__(
+        self,
+        endpoint,
+        transform,
+        write,
+        context=None,
+        checkpoint=None,
+        fetch_workers=APP.FETCH_THREADS,
+        transform_workers=APP.TRANSFORM_THREADS,
+        write_workers=APP.WRITE_THREADS,
+        queue_size=APP.QUEUE_SIZE,
+        batch_size=APP.WRITE_BATCH_SIZE,
+        max_attempts=APP.PAGE_ATTEMPTS,
+        dead_letter=APP.DEAD_LETTER_FILE,
+    ):
+        self.endpoint = endpoint
+        self.transform = transform
+        self.write = write
+        self.context = context
+        self.checkpoint = checkpoint
+        self.fetch_workers = fetch_workers
+        self.transform_workers = transform_workers
+        self.write_workers = write_workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.dead_letter = dead_letter
+
+        # bounded queues give backpressure so a slow stage holds back the
+        # ones before it instead of piling pages up in memory
+        self.tasks = queue.Queue(maxsize=queue_size)
+        self.fetched = queue.Queue(maxsize=queue_size)
+        self.transformed = queue.Queue(maxsize=queue_size)
+
+        self.lock = threading.Lock()
+        self.summary = WriteResult()
+        self.progress = None
+
+        # pages queued, being fetched or waiting for a retry
+        self.outstanding = 0
+        self.fetching = threading.Condition()
+
+    def run(self, tasks, total=None, prefetched=()):
+        """
+        Run all tasks (pages) through the pipeline
+
+        params:
+        tasks: iterable - query parameters of the pages, consumed lazily
+        total: int - number of pages for the progress bar
+        prefetched: iterable - (task, records) of pages already fetched,
+        handed straight to the transform stage
+
+        returns: WriteResult
+        """
+        self.progress = tqdm(total=total, unit="page")
+
+        fetchers = self._start(self._fetch_worker, self.fetch_workers)
+        transformers = self._start(self._transform_worker, self.transform_workers)
+        writers = self._start(self._write_worker, self.write_workers)
+
+        for task, records in prefetched:
+            if self.checkpoint and self.checkpoint.is_done(task):
+                self._page_done()
+                continue
+            page_cache.save(self.endpoint, task, records)
+            self.fetched.put((task, records))
+
+        for task in tasks:
+            if self.checkpoint and self.checkpoint.is_done(task):
+                self._page_done()
+                continue
+            with self.fetching:
+                self.outstanding += 1
+            self.tasks.put((task, 1))
+
+        # retries go back on the task queue, so wait for them to settle
+        with self.fetching:
+            while self.outstanding:
+                self.fetching.wait()
+
+        # shut the stages down in order once the previous one is drained
+        self._finish(self.tasks, fetchers)
+        self._finish(self.fetched, transformers)
+        self._finish(self.transformed, writers)
+
+        self.progress.close()
+        return self.summary
+
+    @staticmethod
+    def _start(target, workers):
+        threads = [
+            threading.Thread(target=target, daemon=True) for _ in range(max(workers, 1))
+        ]
+        for thread in threads:
+            thread.start()
+        return threads
+
+    @staticmethod
+    def _finish(stage_queue, threads):
+        for _ in threads:
+            stage_queue.put(_DONE)
+        for thread in threads:
+            thread.join()
+
+    def _page_done(self, pages=1, result=None):
+        with self.lock:
+            if result:
+                self.summary += result
+            # show how many requests the server currently lets us run at once
+            self.progress.set_postfix(
+                concurrency=int(throttle.limiter.limit), refresh=False
+            )
+            self.progress.update(pages)
+
+    def _fetch_done(self):
+        with self.fetching:
+            self.outstanding -= 1
+            self.fetching.notify_all()
+
+    def _fetched(self, task, records):
+        """Hand a fetched page to the transform stage."""
+        page_cache.save(self.endpoint, task, records)
+        self.fetched.put((task, records))
+        self._fetch_done()
+
+    def _fetch_failed(self, task, attempt, error):
+        """Schedule another attempt for a page or give up on it."""
+        if attempt < self.max_attempts:
+            metrics.inc("page_retries", resource=self.endpoint)
+            retry = threading.Timer(
+                backoff_delay(attempt), self.tasks.put, ((task, attempt + 1),)
+            )
+            retry.daemon = True
+            retry.start()
+            return
+
+        self._give_up(task, attempt, error)
+
+    def _give_up(self, task, attempt, error):
+        """Count a page as failed and keep it in the dead-letter file."""
+        print(
+            f"{error} for page {task.get('page')}, giving up after {attempt} attempts"
+        )
+        try:
+            record_failed_page(
+                self.dead_letter, self.endpoint, task, self.context, error
+            )
+            metrics.inc("failed_pages", resource=self.endpoint)
+            self._page_done(result=WriteResult(failed_pages=1))
+        finally:
+            # the pipeline waits for every page to be settled
+            self._fetch_done()
+
+    def _fetch_worker(self):
+        while True:
+            item = self.tasks.get()
+            if item is _DONE:
+                return
+            task, attempt = item
+            try:
+                records = fetch_page(self.endpoint, task)
+            except Exception as e:
+                self._fetch_failed(task, attempt, e)
+                continue
+            self._fetched(task, records)
+
+    def _transform_worker(self):
+        while True:
+            item = self.fetched.get()
+            if item is _DONE:
+                return
+            task, records = item
+            try:
+                with metrics.timer("transform_seconds", resource=self.endpoint):
+                    records, skipped = self.transform(records)
+            except Exception as e:
+                # counted as failed so watermarks and checkpoints hold back
+                print(f"{e} while processing page {task.get('page')}")
+                record_failed_page(
+                    self.dead_letter, self.endpoint, task, self.context, e
+                )
+                metrics.inc("failed_pages", resource=self.endpoint)
+                self._page_done(result=WriteResult(failed=len(records), failed_pages=1))
+                continue
+            self.transformed.put((task, records, skipped))
+
+    def _write_worker(self):
+        done = False
+        while not done:
+            item = self.transformed.get()
+            if item is _DONE:
+                return
+
+            # coalesce small pages already waiting into one bulk write
+            pending = [item]
+            num_of_records = len(item[1])
+            while num_of_records < self.batch_size:
+                try:
+                    item = self.transformed.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _DONE:
+                    done = True
+                    break
+                pending.append(item)
+                num_of_records += len(item[1])
+
+            records = [record for _, page, _ in pending for record in page]
+            skipped = sum(skipped for _, _, skipped in pending)
+            try:
+                result = self.write(records)
+            except Exception as e:
+                print(f"Unexpected Error: {e}")
+                result = WriteResult(failed=len(records))
+                error = e
+            else:
+                error = f"{result.failed} records failed to be written"
+            if result.failed:
+                # fetched again from the dead-letter file by --retry-failed
+                for task, _, _ in pending:
+                    record_failed_page(
+                        self.dead_letter, self.endpoint, task, self.context, error
+                    )
+                metrics.inc("failed_pages", len(pending), resource=self.endpoint)
+                result.failed_pages += len(pending)
+            result.skipped += skipped
+            if self.checkpoint and not result.failed:
+                # only now are the records of these pages safely stored
+                try:
+                    self.checkpoint.mark_done([task for task, _, _ in pending])
+                except Exception as e:
+                    # counted as failed so the checkpoint is kept for a resume
+                    print(f"{e} while saving the checkpoint of written pages")
+                    result.failed_pages += len(pending)
+            self._page_done(len(pending), result)
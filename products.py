@@ -1,35 +1,46 @@
 """
 Module to import all products or specific product from WooCommerce
 """
-import concurrent.futures
+from math import ceil
 from datetime import datetime
-from tqdm import tqdm
 from dateutil import parser as dateparser
-from config import DB, APP
+from config import APP, DB
 from connections import wcapi, db
+from checkpoints import Checkpoint
+from pipeline import get_page
+from sharding import plan_windows
+from writer import bulk_upsert
+from dates import PRODUCT_DATES
+from id_index import IdIndex, find_ids
+import importing
+import profiles
 
-MAX_THREADS = APP.MAX_THREADS
 max_product_per_page = 100
 
-# list of products ids that are in the database currently
-products_in_db = set()
-
-num_of_written_records = 0
-num_of_skipped_records = 0
+# ids of the products in the range that are in the database (sync mode)
+products_in_db = IdIndex()
 
 
 def get_products_in_db(from_date, to_date):
-    """Get all products in the range given that are in the database."""
+    """Get the ids of all products in the range given that are in the database."""
     # Mongo friendly datetime
     from_date = dateparser.isoparse(from_date)
     to_date = dateparser.isoparse(to_date)
-    results = db[DB.PRODUCT_COLLECTION].find(
+    return find_ids(
+        db[DB.PRODUCT_COLLECTION],
         {"date_created": {"$gte": from_date, "$lte": to_date}},
     )
-    return results
 
 
-def import_all_products(sort, from_date, to_date, sync=False):
+def import_all_products(
+    sort,
+    from_date,
+    to_date,
+    sync=False,
+    engine="threads",
+    resume=False,
+    shard_size=APP.SHARD_SIZE,
+):
     """
     Import all products between from_date and to_date
 
@@ -37,170 +48,205 @@ def import_all_products(sort, from_date, to_date, sync=False):
     sort: str - Sort products ascending or descending.
     from_date: str - import products submitted starting from this date
     to_date: str - import products submitted untill this date
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    resume: bool - skip pages written by an earlier run of the same range
+    shard_size: int - split the range into date windows of about this many
+    products instead of paginating through the whole range (0 to turn off)
 
     returns: list of products
     """
-    global num_of_skipped_records, num_of_written_records
-
     if sync == True:
-        # get all products that are in the database first
-        results = get_products_in_db(from_date, to_date)
-        for product in results:
-            products_in_db.add(product.get("id"))
+        # get the ids of all products that are in the database first
+        products_in_db.load(get_products_in_db(from_date, to_date))
+    else:
+        products_in_db.clear()
 
     print("Products found in DB: ", len(products_in_db))
 
     after = datetime.fromisoformat(from_date)
     before = datetime.fromisoformat(to_date)
+    prefetched = []
+
+    if shard_size:
+        # shallow pages of stable windows instead of deep offsets, which
+        # get slower the deeper they go and shift as products are added
+        try:
+            windows = plan_windows("products", after, before, shard_size)
+        except Exception as e:
+            print(f"{e} while planning date windows, nothing imported")
+            return
+
+        if sort == "desc":
+            windows.reverse()
+        tasks = [
+            page_params(page, sort, start, end)
+            for start, end, total in windows
+            for page in range(1, ceil(total / max_product_per_page) + 1)
+        ]
+        total_pages = len(tasks)
+        print(f"Date windows: {len(windows)}, total pages: {total_pages}\n")
+    else:
+        try:
+            initial_products = get_page("products", page_params(1, sort, after, before))
+        except Exception as e:
+            print(f"{e} for the first page, nothing imported")
+            return
+
+        total_pages = int(initial_products.headers.get("X-WP-TotalPages", 0))
+        print(f"Total pages: {total_pages}\n")
+        # the first page is processed as it is, the rest fetched meanwhile
+        if total_pages:
+            first_page = (page_params(1, sort, after, before), initial_products.json())
+            prefetched.append(first_page)
+        pages = range(2, total_pages + 1)
+        tasks = (page_params(page, sort, after, before) for page in pages)
+
+    checkpoint = Checkpoint(f"products:{from_date}:{to_date}:{sort}")
+    if resume:
+        print(f"Pages already imported: {len(checkpoint.done)}\n")
+    else:
+        checkpoint.clear()
+
+    summary = import_pages(
+        tasks, total_pages, engine, checkpoint=checkpoint, prefetched=prefetched
+    )
+    summary.print_summary()
 
-    page = 1
-    initial_products = wcapi.get(
+    if not summary.failed and not summary.failed_pages:
+        # the whole range is imported, nothing is left to resume
+        checkpoint.clear()
+
+
+def retry_failed_products(path, engine="threads"):
+    """
+    Fetch again the pages of products recorded in a dead-letter file
+
+    params:
+    path: str - dead-letter file written by a previous import
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    importing.retry_failed(
+        "products", process_products, DB.PRODUCT_COLLECTION, path, engine
+    )
+
+
+def import_cached_products():
+    """Transform and write again the pages of products saved in the page cache."""
+    products_in_db.clear()
+    importing.import_cached("products", process_products, DB.PRODUCT_COLLECTION)
+
+
+def import_modified_products(from_date=None, engine="threads"):
+    """
+    Import products modified since the newest one imported by the previous
+    incremental import, and move the watermark forward
+
+    params:
+    from_date: str - GMT datetime to start from when there is no watermark yet
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    importing.import_modified(
         "products",
-        params={
-            "per_page": max_product_per_page,
-            "after": after.isoformat(),
-            "before": before.isoformat(),
-            "page": page,
-            "order": sort,
-        },
+        process_products,
+        DB.PRODUCT_COLLECTION,
+        modified_page_params,
+        max_product_per_page,
+        from_date,
+        engine,
     )
-    total_pages = initial_products.headers.get("X-WP-TotalPages", 0)
-    print(f"Total pages: {total_pages}\n")
-    pages = range(1, int(total_pages) + 1)
-
-    # use multi-threading to pull multiple products concurrently
-    with concurrent.futures.ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        future_to_product = {
-            executor.submit(get_products, page, sort, after, before): page
-            for page in pages
-        }
-        for future in tqdm(
-            concurrent.futures.as_completed(future_to_product),
-            total=int(total_pages),
-            unit="page",
-        ):
-            try:
-                status = future.result()
-            except:
-                pass
-
-    print(f'\n\n{"-" * 50}')
-    print(f"Newly inserted records: {num_of_written_records}")
-    print(f"Skipped records: {num_of_skipped_records}\n")
-
-
-def get_products(page, sort, after, before):
-    """Get products on a specific page."""
-    try:
-        response = wcapi.get(
-            "products",
-            params={
-                "per_page": max_product_per_page,
-                "after": after.isoformat(),
-                "before": before.isoformat(),
-                "page": page,
-                "order": sort,
-            },
-        )
-        if response.status_code != 200:
-            print(f"Error status code {response.status_code} for page {page}")
-        else:
-            products = tuple(response.json())
-            for product in products:
-                process_product(product)
-
-            products = None  # clear previous values to free up memeory
-            return True
-    except Exception as e:
-        print(f"Unexpected Error: {e}")
-    return False
+
+
+def import_pages(
+    tasks,
+    total,
+    engine="threads",
+    dead_letter=APP.DEAD_LETTER_FILE,
+    checkpoint=None,
+    prefetched=(),
+):
+    """
+    Fetch, process and write the pages of products given by their query params,
+    and the (params, records) of pages already fetched
+    """
+    return importing.import_pages(
+        "products",
+        process_products,
+        DB.PRODUCT_COLLECTION,
+        tasks,
+        total,
+        engine,
+        dead_letter=dead_letter,
+        checkpoint=checkpoint,
+        prefetched=prefetched,
+    )
+
+
+def page_params(page, sort, after, before):
+    """Query parameters to request a specific page of products."""
+    return {
+        "per_page": max_product_per_page,
+        "after": after.isoformat(),
+        "before": before.isoformat(),
+        "page": page,
+        "order": sort,
+    }
+
+
+def modified_page_params(page, modified_after):
+    """Query parameters to request a page of products modified after a GMT date."""
+    return {
+        "per_page": max_product_per_page,
+        "modified_after": modified_after,
+        "dates_are_gmt": "true",
+        "orderby": "modified",
+        "order": "asc",
+        "page": page,
+    }
+
+
+def process_products(records):
+    """
+    Process a page of products and leave out the ones already in the database
+
+    returns: tuple of processed products and number of skipped products
+    """
+    products = []
+    skipped = 0
+    for product in records:
+        product = process_product(product)
+        if not product:
+            continue
+        if product["id"] in products_in_db:
+            # print(f"Product id: {product['id']} found in DB (skipping)")
+            skipped += 1
+            continue
+        products.append(product)
+
+    return products, skipped
 
 
 def process_product(product):
     """
     Process product to convert date and times to datetime objects
-    and insert to MongoDB database
-    """
-    global num_of_skipped_records, num_of_written_records
 
+    returns: processed product or None if it has no id
+    """
     if not product.get("id", None):
         print("No product id skipping")
-        return
+        return None
 
-    date_fields = [
-        "date_created",
-        "date_created_gmt",
-        "date_modified",
-        "date_modified_gmt",
-        "date_on_sale_from",
-        "date_on_sale_from_gmt",
-        "date_on_sale_to",
-        "date_on_sale_to_gmt",
-    ]
-    image_date_fields = date_fields[:4]
-    for field in date_fields:
-        if field not in product:
-            continue
-        str_date = product[field]
-        if not str_date:
-            continue
-        product[field] = dateparser.isoparse(str_date)
-
-    for field in image_date_fields:
-        for i in range(len(product["images"])):
-            if field not in product["images"][i]:
-                continue
-            str_date = product["images"][i][field]
-            if not str_date:
-                continue
-            product["images"][i][field] = dateparser.isoparse(str_date)
-
-    product_id = product.get("id")
-    if product_id not in products_in_db:
-        db[DB.PRODUCT_COLLECTION].find_one_and_replace(
-            filter={"id": product_id}, replacement=product, upsert=True
-        )
-        num_of_written_records += 1
-    else:
-        # print(f"Product id: {product_id} found in DB (skipping)")
-        num_of_skipped_records += 1
+    product = profiles.trim("products", product)
+
+    product = PRODUCT_DATES(product)
+
+    return product
 
 
 def get_product(id):
     """Get specific product specified by ID."""
-    product = wcapi.get(f"products/{id}").json()
-    if not product.get("id", None):
-        print("No product id skipping")
+    params = profiles.with_fields("products", {})
+    product = process_product(wcapi.get(f"products/{id}", params=params).json())
+    if not product:
         return
 
-    date_fields = [
-        "date_created",
-        "date_created_gmt",
-        "date_modified",
-        "date_modified_gmt",
-        "date_on_sale_from",
-        "date_on_sale_from_gmt",
-        "date_on_sale_to",
-        "date_on_sale_to_gmt",
-    ]
-    for field in date_fields:
-        if field not in product:
-            continue
-        str_date = product[field]
-        if not str_date:
-            continue
-        product[field] = dateparser.isoparse(str_date)
-
-    image_date_fields = date_fields[:4]
-    for field in image_date_fields:
-        for i in range(len(product["images"])):
-            if field not in product["images"][i]:
-                continue
-            str_date = product["images"][i][field]
-            if not str_date:
-                continue
-            product["images"][i][field] = dateparser.isoparse(str_date)
-
-    db[DB.PRODUCT_COLLECTION].find_one_and_replace(
-        filter={"id": product.get("id")}, replacement=product, upsert=True
-    )
+    bulk_upsert(db[DB.PRODUCT_COLLECTION], [product])
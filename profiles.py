@@ -0,0 +1,118 @@
+"""
+Module with the payload profiles of each resource: the fields requested
+from WooCommerce with the WP REST `_fields` parameter and kept in MongoDB.
+The "full" profile keeps whole records, e.g. for archival imports.
+"""
+from config import APP
+
+PROFILES = {
+    "full": {"orders": None, "products": None, "customers": None},
+    "slim": {
+        # meta_data and _links make up most of an order
+        "orders": [
+            "id",
+            "parent_id",
+            "number",
+            "status",
+            "currency",
+            "prices_include_tax",
+            "discount_total",
+            "shipping_total",
+            "total",
+            "total_tax",
+            "customer_id",
+            "customer_note",
+            "billing",
+            "shipping",
+            "payment_method",
+            "payment_method_title",
+            "transaction_id",
+            "line_items",
+            "tax_lines",
+            "shipping_lines",
+            "fee_lines",
+            "coupon_lines",
+            "refunds",
+            "date_created",
+            "date_created_gmt",
+            "date_modified",
+            "date_modified_gmt",
+            "date_paid",
+            "date_paid_gmt",
+            "date_completed",
+            "date_completed_gmt",
+        ],
+        "products": [
+            "id",
+            "name",
+            "slug",
+            "permalink",
+            "type",
+            "status",
+            "sku",
+            "price",
+            "regular_price",
+            "sale_price",
+            "on_sale",
+            "total_sales",
+            "stock_quantity",
+            "stock_status",
+            "categories",
+            "tags",
+            "images",
+            "attributes",
+            "variations",
+            "parent_id",
+            "date_created",
+            "date_created_gmt",
+            "date_modified",
+            "date_modified_gmt",
+            "date_on_sale_from",
+            "date_on_sale_from_gmt",
+            "date_on_sale_to",
+            "date_on_sale_to_gmt",
+        ],
+        "customers": [
+            "id",
+            "email",
+            "first_name",
+            "last_name",
+            "username",
+            "role",
+            "billing",
+            "shipping",
+            "is_paying_customer",
+            "date_created",
+            "date_created_gmt",
+            "date_modified",
+            "date_modified_gmt",
+        ],
+    },
+}
+
+# profile used by this run
+selected = APP.PAYLOAD_PROFILE
+
+
+def select(profile):
+    """Use a profile for every request and record of this run."""
+    global selected
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown payload profile '{profile}'")
+    selected = profile
+
+
+def with_fields(resource, params):
+    """Add the `_fields` of the selected profile to the query parameters."""
+    fields = PROFILES[selected].get(resource)
+    if not fields:
+        return params
+    return dict(params, _fields=",".join(fields))
+
+
+def trim(resource, record):
+    """Drop the keys the selected profile does not keep."""
+    fields = PROFILES[selected].get(resource)
+    if not fields:
+        return record
+    return {key: value for key, value in record.items() if key in fields}
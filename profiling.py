@@ -0,0 +1,154 @@
+"""
+Module to profile an import: wall and CPU time of each pipeline stage over
+all threads, and optionally stack samples (a collapsed-stack file for
+flamegraphs) or cProfile statistics
+"""
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from config import APP
+import metrics
+
+# stages timed by the metrics, in pipeline order
+STAGES = [
+    ("http_request_seconds", "HTTP requests"),
+    ("json_decode_seconds", "JSON decode"),
+    ("transform_seconds", "Transform"),
+    ("mongo_write_seconds", "MongoDB writes"),
+]
+
+mode = None
+output = None
+started = None
+sampler = None
+profilers = []
+profilers_lock = threading.Lock()
+
+
+class Sampler(threading.Thread):
+    """
+    Takes the stacks of all other threads every `interval` seconds, which
+    costs far less than tracing every call
+    """
+
+    def __init__(self, interval=APP.PROFILE_INTERVAL):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+                    stack.append(f"{module}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def write(self, path):
+        """Write the samples as collapsed stacks (flamegraph.pl, speedscope)."""
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+def _profile_thread(frame, event, arg):
+    # runs once in every new thread and hands it over to its own profiler
+    profiler = cProfile.Profile()
+    with profilers_lock:
+        profilers.append(profiler)
+    profiler.enable()
+
+
+def start(profile_mode, path_prefix=APP.PROFILE_OUTPUT):
+    """
+    Start profiling the command
+
+    params:
+    profile_mode: str - "stages" (stage times only), "sample" (and stack
+    samples) or "cprofile" (and cProfile of every thread)
+    path_prefix: str - files are written as <prefix>.collapsed/.pstats
+    """
+    global mode, output, started, sampler
+    mode, output = profile_mode, path_prefix
+    started = (time.perf_counter(), time.process_time())
+
+    if mode in ("sample", "cprofile"):
+        sampler = Sampler()
+        sampler.start()
+    if mode == "cprofile":
+        if sys.version_info < (3, 12):
+            threading.setprofile(_profile_thread)
+        # from 3.12 cProfile runs on sys.monitoring, which allows one profiler
+        # per process and already sees every thread
+        _profile_thread(None, None, None)
+
+
+def stop():
+    """Stop profiling, print the summary and write the profile files."""
+    if not mode:
+        return
+    wall = time.perf_counter() - started[0]
+    cpu = time.process_time() - started[1]
+
+    if mode == "cprofile":
+        if sys.version_info < (3, 12):
+            threading.setprofile(None)
+        for profiler in profilers:
+            profiler.disable()
+
+    print_summary(wall, cpu)
+
+    if sampler:
+        sampler.stop()
+        sampler.write(f"{output}.collapsed")
+        print(f"Stack samples written to '{output}.collapsed'")
+
+    if profilers:
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(f"{output}.pstats")
+        print(f"cProfile statistics written to '{output}.pstats'\n")
+        if sys.version_info >= (3, 12):
+            print("The threads share one profiler, cumulative times mix them.\n")
+        stats.sort_stats("cumulative").print_stats(15)
+
+
+def print_summary(wall, cpu):
+    """Print the time of each stage summed over all threads."""
+    totals = metrics.collect()
+    print(f'\n\n{"-" * 70}')
+    print(f"Run: {wall:.2f}s wall, {cpu:.2f}s CPU (all threads)\n")
+    print(
+        f'{"Stage":<16}{"Calls":>8}{"Wall s":>11}{"Mean ms":>10}{"CPU s":>10}{"CPU %":>8}'
+    )
+    for name, title in STAGES:
+        calls = stage_wall = stage_cpu = 0
+        for (key, labels), value in totals.items():
+            if key == name:
+                calls += sum(value[0])
+                stage_wall += value[1]
+            elif key == "cpu_seconds" and dict(labels).get("stage") == name:
+                stage_cpu += value
+        if not calls:
+            continue
+        print(
+            f"{title:<16}{calls:>8}{stage_wall:>11.2f}{stage_wall / calls * 1000:>10.1f}"
+            f"{stage_cpu:>10.2f}{stage_cpu / stage_wall * 100 if stage_wall else 0:>7.0f}%"
+        )
+    print("\nWall times overlap, the stages run on many threads at once.\n")
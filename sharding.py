@@ -0,0 +1,69 @@
+"""
+Module to split a date range into windows of about the same number of
+records, so each window is fetched with a few shallow pages instead of
+paginating deep into one large result set
+"""
+import concurrent.futures
+from datetime import timedelta
+from config import APP
+from pipeline import get_page
+
+# windows this short are not split any further
+MIN_WINDOW = timedelta(seconds=2)
+
+
+def count_records(endpoint, after, before):
+    """Number of records created in the window, from X-WP-Total."""
+    response = get_page(
+        endpoint,
+        {
+            "per_page": 1,
+            "after": after.isoformat(),
+            "before": before.isoformat(),
+            "page": 1,
+        },
+    )
+    return int(response.headers.get("X-WP-Total", 0))
+
+
+def split_window(after, before):
+    """
+    Split a window in two at the whole second in the middle
+
+    The API treats both after and before as exclusive, so the left window
+    ends a second past the middle to keep records created exactly on it.
+    """
+    middle = after + (before - after) / 2
+    middle = middle.replace(microsecond=0)
+    return (after, middle + timedelta(seconds=1)), (middle, before)
+
+
+def plan_windows(endpoint, after, before, target=APP.SHARD_SIZE):
+    """
+    Split [after, before] into windows holding at most `target` records
+
+    The windows of each level are probed concurrently.
+
+    params:
+    endpoint: str - WooCommerce endpoint, e.g. "orders"
+    after: datetime - start of the range
+    before: datetime - end of the range
+    target: int - records wanted per window
+
+    returns: list of (after, before, number of records) sorted by date
+    """
+    windows = []
+    level = [(after, before)]
+    with concurrent.futures.ThreadPoolExecutor(max_workers=APP.MAX_THREADS) as executor:
+        while level:
+            totals = executor.map(lambda w: count_records(endpoint, *w), level)
+            next_level = []
+            for (start, end), total in zip(level, totals):
+                if total <= target or end - start <= MIN_WINDOW:
+                    if total:
+                        windows.append((start, end, total))
+                else:
+                    next_level.extend(split_window(start, end))
+            level = next_level
+
+    return sorted(windows)
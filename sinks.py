@@ -0,0 +1,227 @@
+"""
+Module to write the imported records to files next to MongoDB: NDJSON
+(plain, gzip or zstd) and Parquet, picked by the file extension
+"""
+import gzip
+import io
+import json
+import threading
+from datetime import datetime
+from config import APP
+from dates import CUSTOMER_DATES, ORDER_DATES, PRODUCT_DATES
+import metrics
+
+# file sinks of the current run, every written page goes to each of them
+active = []
+
+# stored for MongoDB only, not exported
+EXCLUDED = ("_hash",)
+
+DATE_FIELDS = set(ORDER_DATES.fields + PRODUCT_DATES.fields + CUSTOMER_DATES.fields)
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+class NdjsonSink:
+    """
+    One JSON record per line, compressed when the path ends with .gz or
+    .zst (zstd needs the zstandard package)
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        if path.endswith(".zst"):
+            try:
+                import zstandard
+            except ImportError:
+                raise RuntimeError(
+                    "zstd output requires zstandard (pip install zstandard)"
+                )
+            raw = zstandard.ZstdCompressor().stream_writer(open(path, "wb"))
+            self.file = io.TextIOWrapper(raw, encoding="utf-8")
+        elif path.endswith(".gz"):
+            self.file = gzip.open(path, "wt", encoding="utf-8")
+        else:
+            self.file = open(path, "w", encoding="utf-8")
+
+    def write(self, records):
+        lines = "".join(
+            json.dumps(
+                {k: v for k, v in record.items() if k not in EXCLUDED},
+                default=_json_default,
+                separators=(",", ":"),
+            )
+            + "\n"
+            for record in records
+        )
+        with self.lock:
+            self.file.write(lines)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetSink:
+    """
+    Parquet file written a row group at a time (needs pyarrow)
+
+    The columns are fixed by the first row group. The date fields of the
+    resources are timestamp columns, other scalars keep the type they have
+    there, and nested lists and objects (line_items, meta_data...) and
+    fields that are always empty there are JSON strings. A later value that
+    does not fit its column, and any field the first group did not have, is
+    kept as JSON in the `_extra` column.
+    """
+
+    def __init__(self, path, row_group_size=APP.EXPORT_ROW_GROUP_SIZE):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet output requires pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.row_group_size = row_group_size
+        self.lock = threading.Lock()
+        self.records = []
+        # column -> python types its values may have (None for strings)
+        self.columns = None
+        self.schema = None
+        self.writer = None
+
+    def _plan_columns(self, records):
+        """Pick the type of every column from the first row group."""
+        seen = {}
+        for record in records:
+            for key, value in record.items():
+                types = seen.setdefault(key, set())
+                if value is not None:
+                    types.add(type(value))
+
+        pa = self.pa
+        self.columns = {}
+        fields = []
+        for key, types in seen.items():
+            if key in EXCLUDED:
+                continue
+            if key in DATE_FIELDS:
+                column = (pa.timestamp("us"), (datetime,))
+            elif types == {bool}:
+                column = (pa.bool_(), (bool,))
+            elif types == {int}:
+                column = (pa.int64(), (int,))
+            elif types and types <= {int, float}:
+                column = (pa.float64(), (int, float))
+            else:
+                column = (pa.string(), None)
+            self.columns[key] = column[1]
+            fields.append(pa.field(key, column[0]))
+        fields.append(pa.field("_extra", pa.string()))
+        self.schema = pa.schema(fields)
+        self.writer = self.pq.ParquetWriter(self.path, self.schema)
+
+    def _row(self, record):
+        row = {}
+        extra = {}
+        for key, value in record.items():
+            if key in EXCLUDED:
+                continue
+            if key not in self.columns:
+                extra[key] = value
+                continue
+            types = self.columns[key]
+            if value is None:
+                row[key] = None
+            elif types is None:
+                row[key] = (
+                    value
+                    if isinstance(value, str)
+                    else json.dumps(value, default=_json_default)
+                )
+            elif type(value) in types:
+                row[key] = value
+            else:
+                extra[key] = value
+        row["_extra"] = json.dumps(extra, default=_json_default) if extra else None
+        return row
+
+    def write(self, records):
+        with self.lock:
+            self.records.extend(records)
+            while len(self.records) >= self.row_group_size:
+                group = self.records[: self.row_group_size]
+                self.records = self.records[self.row_group_size :]
+                self._write_group(group)
+
+    def _write_group(self, records):
+        if self.writer is None:
+            self._plan_columns(records)
+        rows = [self._row(record) for record in records]
+        table = self.pa.Table.from_pylist(rows, schema=self.schema)
+        self.writer.write_table(table, row_group_size=self.row_group_size)
+
+    def close(self):
+        with self.lock:
+            if self.records:
+                self._write_group(self.records)
+                self.records = []
+            if self.writer is not None:
+                self.writer.close()
+
+
+def open_sink(path):
+    """Sink for a file path, by its extension."""
+    if path.endswith(".parquet"):
+        return ParquetSink(path)
+    if path.endswith((".ndjson", ".jsonl", ".ndjson.gz", ".ndjson.zst")):
+        return NdjsonSink(path)
+    raise ValueError(
+        f"Unknown export file type '{path}' (.parquet, .ndjson, .ndjson.gz, .ndjson.zst)"
+    )
+
+
+def open_all(paths):
+    """Open the file sinks every import of this run writes to."""
+    for path in paths:
+        active.append(open_sink(path))
+
+
+def close_all():
+    """Flush and close the file sinks of the run."""
+    while active:
+        sink = active.pop()
+        try:
+            sink.close()
+        except Exception as e:
+            print(f"Error closing export '{sink.path}': {e}")
+
+
+def with_exports(write):
+    """
+    Writer that passes the records to `write` and then to the file sinks
+
+    An export error is reported without failing the records, they are
+    already in MongoDB by then.
+
+    returns: `write` itself when no file sink is open
+    """
+    if not active:
+        return write
+
+    def write_all(records):
+        result = write(records)
+        for sink in active:
+            try:
+                sink.write(records)
+            except Exception as e:
+                print(f"Error exporting {len(records)} records to '{sink.path}': {e}")
+                metrics.inc("export_errors", path=sink.path)
+        return result
+
+    return write_all
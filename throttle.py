@@ -0,0 +1,133 @@
+"""
+Module to adapt the number of requests in flight to what the WooCommerce
+server can sustain (additive increase, multiplicative decrease)
+"""
+import asyncio
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from config import APP
+
+# responses that mean the server is overloaded
+OVERLOAD_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a Retry-After header (seconds or HTTP date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0)
+
+
+class AdaptiveLimiter:
+    """
+    Limit on concurrent requests that grows by about one request per round
+    trip while responses are fast and successful, and is cut on overload
+    responses or when latency climbs well above the fastest seen
+
+    params:
+    initial: int - starting limit
+    minimum: int - the limit never goes below this
+    maximum: int - the limit never goes above this
+    latency_tolerance: float - responses slower than the fastest seen times
+    this count as a sign of overload
+    """
+
+    def __init__(
+        self,
+        initial=APP.INITIAL_CONCURRENCY,
+        minimum=1,
+        maximum=APP.MAX_THREADS,
+        latency_tolerance=APP.LATENCY_TOLERANCE,
+    ):
+        self.minimum = minimum
+        self.maximum = max(maximum, minimum)
+        self.limit = float(min(max(initial, minimum), self.maximum))
+        self.latency_tolerance = latency_tolerance
+        self.in_flight = 0
+        self.baseline = None  # fastest latency seen, drifts up slowly
+        self.latency = 0.0  # moving average of latency
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.condition = threading.Condition()
+
+    def _can_start(self):
+        return (
+            self.in_flight < int(self.limit) and time.monotonic() >= self.paused_until
+        )
+
+    def acquire(self):
+        """Block until another request may be sent."""
+        with self.condition:
+            while not self._can_start():
+                self.condition.wait(0.1)
+            self.in_flight += 1
+
+    def try_acquire(self):
+        """Take a request slot if one is free, without blocking."""
+        with self.condition:
+            if not self._can_start():
+                return False
+            self.in_flight += 1
+            return True
+
+    async def acquire_async(self):
+        """Wait on the event loop until another request may be sent."""
+        while not self.try_acquire():
+            await asyncio.sleep(0.01)
+
+    def release(self, latency, status_code=None, retry_after=None):
+        """
+        Give a request slot back and adjust the limit from its outcome
+
+        params:
+        latency: float - seconds the request took
+        status_code: int - response status or None if the request failed
+        retry_after: str - Retry-After header of the response
+        """
+        with self.condition:
+            self.in_flight -= 1
+            now = time.monotonic()
+
+            if status_code is None or status_code in OVERLOAD_STATUS_CODES:
+                wait = parse_retry_after(retry_after)
+                if wait:
+                    self.paused_until = max(self.paused_until, now + wait)
+                self._decrease(now, 0.5)
+            else:
+                if self.baseline is None or latency < self.baseline:
+                    self.baseline = latency
+                else:
+                    self.baseline *= 1.01
+                self.latency = (
+                    0.8 * self.latency + 0.2 * latency if self.latency else latency
+                )
+
+                if latency > self.baseline * self.latency_tolerance:
+                    self._decrease(now, 0.9)
+                elif self.in_flight + 1 >= int(self.limit):
+                    # only grow when the current limit is actually used
+                    self.limit = min(self.limit + 1 / self.limit, self.maximum)
+
+            self.condition.notify_all()
+
+    def _decrease(self, now, factor):
+        # responses to requests sent before the last cut would otherwise
+        # keep cutting the limit for the same overload
+        if now - self.last_decrease < max(self.latency, 0.1):
+            return
+        self.limit = max(self.limit * factor, self.minimum)
+        self.last_decrease = now
+
+
+# shared by every client, importer and engine so the whole process stays
+# within what the server sustains
+limiter = AdaptiveLimiter(maximum=max(APP.FETCH_THREADS, APP.ASYNC_CONCURRENCY))
@@ -0,0 +1,68 @@
+"""
+Module to keep MongoDB in step with WooCommerce from one long-running
+process, polling each resource for records changed since the last poll
+"""
+import time
+from datetime import datetime, timedelta
+import customers, orders, products
+
+
+def watch(intervals, after=None, engine="threads"):
+    """
+    Poll orders, products and customers until interrupted
+
+    Orders and products are fetched by modified date from their watermark,
+    so a poll that runs late covers everything since the previous one in
+    a single window instead of queueing up overlapping ones. Customers have
+    no modified filter and are fetched by registration date since the last
+    poll.
+
+    params:
+    intervals: dict - seconds between polls per resource, 0 turns it off
+    after: str - GMT datetime to start from for resources without a watermark
+    engine: str - fetch pages on "threads" or on an "async" event loop
+    """
+    started = datetime.utcnow()
+    after = after or started.isoformat(timespec="seconds")
+    last_customers_poll = datetime.now() - timedelta(seconds=intervals["customers"])
+
+    def poll_customers():
+        nonlocal last_customers_poll
+        now = datetime.now()
+        customers.import_all_customers(
+            "desc",
+            last_customers_poll.isoformat(timespec="seconds"),
+            now.isoformat(timespec="seconds"),
+        )
+        last_customers_poll = now
+
+    polls = {
+        "orders": lambda: orders.import_modified_orders(after, engine),
+        "products": lambda: products.import_modified_products(after, engine),
+        "customers": poll_customers,
+    }
+    due = {resource: 0 for resource, seconds in intervals.items() if seconds > 0}
+    if not due:
+        print("Nothing to watch, every interval is 0")
+        return
+
+    print(f"Watching {', '.join(due)} (Ctrl+C to stop)...\n")
+    try:
+        while True:
+            resource = min(due, key=due.get)
+            wait = due[resource] - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+            print(
+                f"[{datetime.now().isoformat(timespec='seconds')}] Polling {resource}"
+            )
+            try:
+                polls[resource]()
+            except Exception as e:
+                print(f"Unexpected Error while polling {resource}: {e}")
+
+            # schedule from the end of the poll so slow polls never pile up
+            due[resource] = time.monotonic() + intervals[resource]
+    except KeyboardInterrupt:
+        print("\nStopped watching")
@@ -0,0 +1,23 @@
+"""
+Module to keep the high-water mark of incremental imports, the newest
+date_modified_gmt written for each resource, in a metadata collection
+"""
+from config import DB
+from connections import db
+
+
+def get_watermark(resource):
+    """Newest date_modified_gmt imported for the resource, or None."""
+    meta = db[DB.META_COLLECTION].find_one({"_id": f"watermark:{resource}"})
+    if not meta:
+        return None
+    return meta.get("date_modified_gmt")
+
+
+def set_watermark(resource, date_modified_gmt):
+    """Move the watermark of the resource forward (never backwards)."""
+    db[DB.META_COLLECTION].update_one(
+        {"_id": f"watermark:{resource}"},
+        {"$max": {"date_modified_gmt": date_modified_gmt}},
+        upsert=True,
+    )
@@ -0,0 +1,198 @@
+"""
+Module to receive WooCommerce webhooks and upsert the pushed orders,
+products and customers without requesting any pages from the store
+"""
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from config import APP, DB, WC
+from connections import db
+from writer import is_older, bulk_upsert
+import customers, orders, products, watcher
+
+# topics that carry the full record to upsert
+UPSERT_EVENTS = ("created", "updated", "restored")
+
+
+def process_seller(customer):
+    """Process a pushed customer, only sellers are imported."""
+    if customer.get("role") != "seller":
+        return None
+    return customers.process_customer(customer)
+
+
+# webhook resource -> (transform, collection)
+RESOURCES = {
+    "order": (orders.process_order, DB.ORDER_COLLECTION),
+    "product": (products.process_product, DB.PRODUCT_COLLECTION),
+    "customer": (process_seller, DB.CUSTOMER_COLLECTION),
+}
+
+
+def verify_signature(body, signature, secret=WC.WEBHOOK_SECRET):
+    """Check X-WC-Webhook-Signature, the base64 HMAC-SHA256 of the body."""
+    if not secret or not signature:
+        return False
+    digest = hmac.new(secret.encode(), body, hashlib.sha256).digest()
+    return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+
+class EventBuffer:
+    """Pushed records waiting to be written in one bulk upsert per resource."""
+
+    def __init__(self, batch_size=APP.WRITE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.flushing = threading.Lock()
+        self.pending = {resource: {} for resource in RESOURCES}
+
+    def add(self, resource, record):
+        """Buffer a record, keeping only the newest version of each id."""
+        with self.lock:
+            self._keep_newest(resource, record)
+            full = len(self.pending[resource]) >= self.batch_size
+        if full:
+            self.flush()
+
+    def _keep_newest(self, resource, record):
+        pending = self.pending[resource]
+        buffered = pending.get(record["id"])
+        # deliveries can arrive out of order
+        if buffered is None or not is_older(record, buffered):
+            pending[record["id"]] = record
+
+    def flush(self):
+        """
+        Write every buffered record
+
+        The senders already got a 200, so records of a write that raised or
+        reported failed documents go back in the buffer for the next flush
+        (written ones are unchanged by then and not written again).
+        """
+        with self.flushing:
+            with self.lock:
+                pending = self.pending
+                self.pending = {resource: {} for resource in RESOURCES}
+
+            for resource, records in pending.items():
+                if not records:
+                    continue
+                _, collection = RESOURCES[resource]
+                try:
+                    result = bulk_upsert(
+                        db[collection], list(records.values()), newer_only=True
+                    )
+                except Exception as e:
+                    print(f"{e} while writing webhook {resource}s, kept for a retry")
+                    self._put_back(resource, records)
+                    continue
+                print(
+                    f"Webhook {resource}s: {result.inserted} inserted, "
+                    f"{result.updated} updated, {result.failed} failed"
+                )
+                if result.failed:
+                    self._put_back(resource, records)
+
+    def _put_back(self, resource, records):
+        """Buffer records again unless a newer delivery arrived meanwhile."""
+        with self.lock:
+            for record in records.values():
+                self._keep_newest(resource, record)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """Accept webhook deliveries and put their records in the buffer."""
+
+    buffer = None
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        topic = self.headers.get("X-WC-Webhook-Topic")
+        if not topic:
+            # the ping sent when a webhook is saved has no topic
+            self._reply(200)
+            return
+
+        if not verify_signature(body, self.headers.get("X-WC-Webhook-Signature")):
+            self._reply(401)
+            return
+
+        resource, _, event = topic.partition(".")
+        if resource not in RESOURCES or event not in UPSERT_EVENTS:
+            self._reply(200)
+            return
+
+        try:
+            record = json.loads(body)
+        except ValueError:
+            self._reply(400)
+            return
+
+        process, _ = RESOURCES[resource]
+        try:
+            record = process(record)
+        except Exception as e:
+            print(f"{e} while processing a {topic} delivery")
+            self._reply(400)
+            return
+        if record:
+            self.buffer.add(resource, record)
+        self._reply(200)
+
+    def _reply(self, status_code):
+        self.send_response(status_code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host, port, reconcile_interval=APP.WEBHOOK_RECONCILE_INTERVAL):
+    """
+    Receive webhooks until interrupted
+
+    params:
+    host: str - address to listen on
+    port: int - port to listen on
+    reconcile_interval: int - seconds between polls for modified orders and
+    products that catch any missed delivery, 0 turns them off
+    """
+    if not WC.WEBHOOK_SECRET:
+        print("Set webhook_secret to the secret of the WooCommerce webhooks")
+        return
+
+    buffer = EventBuffer()
+    WebhookHandler.buffer = buffer
+    server = ThreadingHTTPServer((host, port), WebhookHandler)
+
+    def flush_periodically():
+        while True:
+            time.sleep(APP.WEBHOOK_FLUSH_INTERVAL)
+            try:
+                buffer.flush()
+            except Exception as e:
+                print(f"Unexpected Error: {e}")
+
+    threading.Thread(target=flush_periodically, daemon=True).start()
+
+    if reconcile_interval:
+        intervals = {
+            "orders": reconcile_interval,
+            "products": reconcile_interval,
+            "customers": 0,
+        }
+        threading.Thread(target=watcher.watch, args=(intervals,), daemon=True).start()
+
+    print(f"Receiving webhooks on http://{host}:{port} (Ctrl+C to stop)...\n")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped receiving webhooks")
+    finally:
+        server.server_close()
+        buffer.flush()
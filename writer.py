@@ -0,0 +1,179 @@
+"""
+Module to write records to MongoDB database in bulk
+"""
+import hashlib
+import json
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+from config import APP
+import metrics
+
+
+class WriteResult:
+    """Counts of records inserted, updated, unchanged, skipped and failed."""
+
+    def __init__(
+        self,
+        inserted=0,
+        updated=0,
+        skipped=0,
+        failed=0,
+        failed_pages=0,
+        last_modified=None,
+        unchanged=0,
+    ):
+        self.inserted = inserted
+        self.updated = updated
+        # stored already with the same content, not written again
+        self.unchanged = unchanged
+        self.skipped = skipped
+        self.failed = failed
+        self.failed_pages = failed_pages
+        # newest date_modified_gmt written, used by incremental imports
+        self.last_modified = last_modified
+
+    def __add__(self, other):
+        return WriteResult(
+            self.inserted + other.inserted,
+            self.updated + other.updated,
+            self.skipped + other.skipped,
+            self.failed + other.failed,
+            self.failed_pages + other.failed_pages,
+            max(
+                (m for m in (self.last_modified, other.last_modified) if m),
+                default=None,
+            ),
+            self.unchanged + other.unchanged,
+        )
+
+    def print_summary(self):
+        """Print the counts at the end of an import."""
+        print(f'\n\n{"-" * 50}')
+        print(f"Newly inserted records: {self.inserted}")
+        print(f"Updated records: {self.updated}")
+        print(f"Unchanged records: {self.unchanged}")
+        print(f"Skipped records: {self.skipped}")
+        print(f"Failed records: {self.failed}")
+        print(f"Failed pages: {self.failed_pages}\n")
+
+
+def bulk_upsert(collection, records, batch_size=APP.WRITE_BATCH_SIZE, newer_only=False):
+    """
+    Upsert records by their WooCommerce id in unordered bulk writes
+
+    Every document is stored with a hash of its content in `_hash`, and
+    records whose hash matches the stored one are not written again.
+
+    params:
+    collection: Collection - MongoDB collection to write to
+    records: list - records to be inserted or replaced
+    batch_size: int - number of records sent in one bulk write
+    newer_only: bool - skip records with an older date_modified_gmt than
+    the stored document, for records that may arrive out of order
+
+    returns: WriteResult
+    """
+    result = WriteResult()
+    for start in range(0, len(records), batch_size):
+        batch = records[start : start + batch_size]
+        result += write_batch(collection, batch, newer_only)
+
+    for name in ("inserted", "updated", "unchanged", "failed"):
+        metrics.inc(
+            "records", getattr(result, name), collection=collection.name, result=name
+        )
+
+    result.last_modified = max(
+        (r["date_modified_gmt"] for r in records if r.get("date_modified_gmt")),
+        default=None,
+    )
+    return result
+
+
+def content_hash(record):
+    """Hash of a record that does not depend on the order of its keys."""
+    content = {key: value for key, value in record.items() if key != "_hash"}
+    encoded = json.dumps(
+        content, sort_keys=True, separators=(",", ":"), default=str
+    ).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+def is_older(record, document):
+    """Whether a record was modified before the stored version of it."""
+    modified = record.get("date_modified_gmt")
+    stored = document.get("date_modified_gmt")
+    return bool(modified and stored and modified < stored)
+
+
+def write_batch(collection, batch, newer_only=False):
+    """Write the changed records of one batch, reporting documents that failed."""
+    if not batch:
+        return WriteResult()
+
+    for record in batch:
+        record["_hash"] = content_hash(record)
+
+    # one query for the stored hashes of the whole batch
+    stored = {
+        document["id"]: document
+        for document in collection.find(
+            {"id": {"$in": [record["id"] for record in batch]}},
+            projection={
+                "id": True,
+                "_hash": True,
+                "date_modified_gmt": True,
+                "_id": False,
+            },
+        )
+    }
+    skipped = 0
+    if newer_only:
+        newer = [r for r in batch if not is_older(r, stored.get(r["id"], {}))]
+        skipped = len(batch) - len(newer)
+        batch = newer
+    unchanged = sum(
+        stored.get(record["id"], {}).get("_hash") == record["_hash"] for record in batch
+    )
+    batch = [
+        record
+        for record in batch
+        if stored.get(record["id"], {}).get("_hash") != record["_hash"]
+    ]
+    if not batch:
+        return WriteResult(unchanged=unchanged, skipped=skipped)
+
+    operations = []
+    for record in batch:
+        query = {"id": record["id"]}
+        if newer_only and record["id"] in stored and record.get("date_modified_gmt"):
+            # a newer version written since the stored one was read wins
+            query["date_modified_gmt"] = {"$lte": record["date_modified_gmt"]}
+            operations.append(ReplaceOne(query, record))
+        else:
+            operations.append(ReplaceOne(query, record, upsert=True))
+    metrics.observe("mongo_batch_size", len(operations), collection=collection.name)
+    try:
+        # unordered so one bad document does not stop the rest of the batch
+        with metrics.timer("mongo_write_seconds", collection=collection.name):
+            result = collection.bulk_write(operations, ordered=False)
+    except BulkWriteError as e:
+        details = e.details
+        errors = details.get("writeErrors", [])
+        for error in errors:
+            record_id = batch[error["index"]].get("id")
+            print(f"Write error for id {record_id}: {error.get('errmsg')}")
+        return WriteResult(
+            inserted=details.get("nUpserted", 0),
+            updated=details.get("nMatched", 0),
+            failed=len(errors),
+            unchanged=unchanged,
+            skipped=skipped,
+        )
+
+    return WriteResult(
+        inserted=result.upserted_count,
+        updated=result.matched_count,
+        unchanged=unchanged,
+        skipped=skipped,
+    )